@@ -0,0 +1,84 @@
+"""在 AstrBot 之外加载插件：为 astrbot.api 注入最小桩模块，仅供基准测试使用
+
+只测转换引擎的脚本直接使用 load_engine()，不经过插件。
+"""
+import importlib
+import logging
+import sys
+import types
+from pathlib import Path
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+# 插件目录作为包导入时使用的名称
+PACKAGE = "charpic_plugin"
+
+
+def _install_stub() -> None:
+    if "astrbot.api" in sys.modules:
+        return
+
+    class _Filter:
+        def __getattr__(self, name):
+            def decorator(*args, **kwargs):
+                return lambda func: func
+            return decorator
+
+    class _Star:
+        def __init__(self, context, config=None):
+            self.context = context
+
+    class _Component:
+        def __init__(self, *args, **kwargs):
+            self.__dict__.update(kwargs)
+
+    astrbot = types.ModuleType("astrbot")
+    api = types.ModuleType("astrbot.api")
+    api.logger = logging.getLogger("charpic.bench")
+    api.AstrBotConfig = dict
+    event = types.ModuleType("astrbot.api.event")
+    event.filter = _Filter()
+    event.AstrMessageEvent = type("AstrMessageEvent", (), {})
+    event.MessageEventResult = type("MessageEventResult", (), {})
+    star = types.ModuleType("astrbot.api.star")
+    star.Context = type("Context", (), {})
+    star.Star = _Star
+    star.register = lambda *args, **kwargs: (lambda cls: cls)
+    components = types.ModuleType("astrbot.api.message_components")
+    for name in ("Plain", "Reply"):
+        setattr(components, name, type(name, (_Component,), {}))
+
+    class Image(_Component):
+        @classmethod
+        def fromBytes(cls, data):
+            return cls(file="base64://", data=data)
+
+    components.Image = Image
+
+    astrbot.api = api
+    sys.modules.update({
+        "astrbot": astrbot,
+        "astrbot.api": api,
+        "astrbot.api.event": event,
+        "astrbot.api.star": star,
+        "astrbot.api.message_components": components,
+    })
+
+
+def _import(name: str):
+    """以包的形式导入插件目录下的模块，使 main.py 中的相对导入生效"""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(PLUGIN_DIR)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+def load_plugin():
+    """返回插件主模块（main.py）"""
+    _install_stub()
+    return _import("main")
+
+
+def load_engine():
+    """返回转换引擎模块（engine.py），不需要 astrbot 桩模块"""
+    return _import("engine")
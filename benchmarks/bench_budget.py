@@ -0,0 +1,136 @@
+"""动图工作量预算验证：检查 _plan_animation 选出的方案不超过预算，以及抽帧后的播放时长
+
+1. 在帧数、画布尺寸、字符宽度下限和预算组成的网格上调用 _plan_animation，
+   断言返回方案的 _animation_cost 不超过预算；仅解码全部源帧就超出预算时断言返回 None。
+2. 用很小的预算转换一个动图，断言 convert_image 抛出 ImageRejected。
+3. 用带不同帧延迟的 GIF 在需要抽帧的预算下转换，断言输出帧数减少且总播放时长不变。
+用法: python benchmarks/bench_budget.py
+"""
+import io
+import itertools
+import logging
+import sys
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+FRAME_COUNTS = (1, 2, 10, 60, 300, 1000, 5000)
+CANVAS_SIZES = ((64, 64), (320, 240), (480, 360), (1280, 720), (1920, 1080), (4000, 3000))
+MIN_CHAR_WIDTHS = (10, 40, 80)
+BUDGETS_MPX = (1.0, 30.0, 300.0, 3000.0)
+# 帧延迟为 10ms 的整数倍，GIF 以百分之一秒保存延迟，不会产生舍入误差
+DURATIONS_MS = (20, 30, 40, 50, 60, 70, 80, 90, 100, 110)
+
+
+def check_plans(cell_size) -> bool:
+    ok = True
+    planned = rejected = 0
+    for frames, size, min_width, budget_mpx in itertools.product(FRAME_COUNTS, CANVAS_SIZES, MIN_CHAR_WIDTHS, BUDGETS_MPX):
+        policy = engine.AnimationPolicy(budget_mpx, 300, 4, min_width)
+        budget = budget_mpx * 1_000_000
+        plan = engine._plan_animation(policy, frames, size, cell_size)
+        decode_cost = frames * size[0] * size[1] * engine.SKIPPED_FRAME_COST_WEIGHT
+        label = f"{frames} 帧 {size[0]}x{size[1]}，宽度下限 {min_width}，预算 {budget_mpx:g}"
+        if decode_cost > budget:
+            if plan is not None:
+                print(f"{label}：仅解码即超出预算，却返回了方案 {plan}")
+                ok = False
+            rejected += 1
+            continue
+        if plan is None:
+            rejected += 1
+            continue
+        stride, char_width = plan
+        cost = engine._animation_cost(frames, size, cell_size, stride, char_width)
+        if cost > budget:
+            print(f"{label}：方案 {plan} 的工作量 {cost / 1e6:.1f} 超出预算")
+            ok = False
+        if not (1 <= stride and min(min_width, engine.ANIMATED_CHAR_WIDTH) <= char_width <= engine.ANIMATED_CHAR_WIDTH):
+            print(f"{label}：方案 {plan} 超出参数范围")
+            ok = False
+        if -(-frames // stride) > policy.max_output_frames:
+            print(f"{label}：方案 {plan} 的输出帧数超过上限")
+            ok = False
+        planned += 1
+    print(f"预算方案：{planned} 组在预算内，{rejected} 组被拒绝")
+    return ok
+
+
+def make_gif(frames: int, size=(160, 120)) -> bytes:
+    """逐帧变化（避免被去重）、帧延迟各不相同的 GIF"""
+    images = []
+    for index in range(frames):
+        gradient = PILImage.linear_gradient("L").resize(size).point(lambda v, s=index * 37: (v + s) % 256)
+        images.append(gradient.convert("P"))
+    durations = [DURATIONS_MS[i % len(DURATIONS_MS)] for i in range(frames)]
+    output = io.BytesIO()
+    images[0].save(output, format="GIF", save_all=True, append_images=images[1:], duration=durations, loop=0)
+    return output.getvalue()
+
+
+def playback(data: bytes):
+    """返回 (帧数, 总播放时长毫秒)"""
+    img = PILImage.open(io.BytesIO(data))
+    total = 0
+    for index in range(getattr(img, "n_frames", 1)):
+        img.seek(index)
+        total += img.info.get("duration", 0)
+    return getattr(img, "n_frames", 1), total
+
+
+def check_rejection(data: bytes) -> bool:
+    instance = engine.CharPicEngine.from_config({"animation_budget_mpx": 0.01})
+    try:
+        instance.convert_image(PILImage.open(io.BytesIO(data)))
+    except engine.ImageRejected as e:
+        print(f"超出预算的动图被拒绝：{e}")
+        return True
+    finally:
+        instance.close()
+    print("超出预算的动图没有抛出 ImageRejected")
+    return False
+
+
+def check_durations(data: bytes) -> bool:
+    source_frames, source_ms = playback(data)
+    ok = True
+    for max_output_frames in (source_frames, source_frames // 3, source_frames // 7):
+        instance = engine.CharPicEngine.from_config({"max_output_frames": max_output_frames})
+        try:
+            result, _ = instance.convert_image(PILImage.open(io.BytesIO(data)))
+        finally:
+            instance.close()
+        if result is None:
+            print(f"max_output_frames={max_output_frames}：转换失败")
+            ok = False
+            continue
+        frames, total_ms = playback(result)
+        print(
+            f"max_output_frames={max_output_frames:>3}：源 {source_frames} 帧 {source_ms} ms -> "
+            f"输出 {frames} 帧 {total_ms} ms"
+        )
+        ok &= frames <= max_output_frames and total_ms == source_ms
+    return ok
+
+
+def main() -> None:
+    logging.getLogger("charpic").setLevel(logging.ERROR)
+    instance = engine.CharPicEngine()
+    cell_size = instance._cell_size()
+    instance.close()
+
+    data = make_gif(70)
+    ok = check_plans(cell_size)
+    ok &= check_rejection(data)
+    ok &= check_durations(data)
+    if not ok:
+        print("动图预算行为与预期不符")
+        sys.exit(1)
+    print("全部检查通过")
+
+
+if __name__ == "__main__":
+    main()
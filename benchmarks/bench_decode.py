@@ -0,0 +1,83 @@
+"""大图解码基准：对比全分辨率解码与降分辨率解码的延迟和峰值内存
+
+每个用例（包括输入生成）都在独立子进程中运行，以便用 ru_maxrss 测得各自的峰值内存；
+父进程不加载任何图片，因为 Linux 的 ru_maxrss 会经 execve 继承给子进程。
+用法: python benchmarks/bench_decode.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+SIZES = ((4000, 3000), (8000, 6000))
+FORMATS = ("JPEG", "PNG")
+
+
+def make_input(path: str, size, fmt: str) -> None:
+    """生成带渐变和噪声的测试图片（纯色图会被编码器压得过小，不具代表性）"""
+    gradient = PILImage.linear_gradient("L").resize(size)
+    noise = PILImage.effect_noise(size, 64)
+    PILImage.merge("RGB", (gradient, noise, gradient.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT))).save(path, format=fmt)
+
+
+def run_case(path: str, mode: str, repeat: int) -> dict:
+    engine = load_engine()
+    instance = engine.CharPicEngine()
+    best = float("inf")
+    for _ in range(repeat):
+        img = PILImage.open(path)
+        start = time.perf_counter()
+        if mode == "full":
+            # 原流程：全分辨率解码并转换灰度后再缩放
+            w, h = img.size
+            gray = img.convert("L").resize((engine.STATIC_CHAR_WIDTH, int(h * engine.STATIC_CHAR_WIDTH / w * engine.FONT_ASPECT_RATIO)))
+            engine._gray_to_text(gray)
+        else:
+            instance._get_pic_text(img)
+        best = min(best, time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"ms": best * 1000, "peak_mb": peak_kb / 1024}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--case", nargs=2, metavar=("PATH", "MODE"), help=argparse.SUPPRESS)
+    parser.add_argument("--make", nargs=4, metavar=("PATH", "W", "H", "FORMAT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make:
+        make_input(args.make[0], (int(args.make[1]), int(args.make[2])), args.make[3])
+        return
+    if args.case:
+        print(json.dumps(run_case(args.case[0], args.case[1], args.repeat)))
+        return
+
+    print(f"{'input':>16} {'full ms':>8} {'full MB':>8} {'reduced ms':>11} {'reduced MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in SIZES:
+            for fmt in FORMATS:
+                path = os.path.join(tmp, f"{size[0]}x{size[1]}.{fmt.lower()}")
+                subprocess.run([sys.executable, __file__, "--make", path, str(size[0]), str(size[1]), fmt], check=True)
+                results = {}
+                for mode in ("full", "reduced"):
+                    output = subprocess.run(
+                        [sys.executable, __file__, "--repeat", str(args.repeat), "--case", path, mode],
+                        check=True, capture_output=True, text=True,
+                    ).stdout
+                    results[mode] = json.loads(output.strip().splitlines()[-1])
+                label = f"{fmt} {size[0]}x{size[1]}"
+                full, reduced = results["full"], results["reduced"]
+                print(f"{label:>16} {full['ms']:>8.1f} {full['peak_mb']:>8.1f} {reduced['ms']:>11.1f} {reduced['peak_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""动图编码基准：对比原 imageio.mimsave 与双色 GIF/WebP/APNG 编码器的耗时和输出大小
+
+用法: python benchmarks/bench_encode.py [--frames N]
+（未安装 imageio 时跳过原实现的对比）
+"""
+import argparse
+import io
+import logging
+import time
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+from bench_frames import make_gif
+
+engine = load_engine()
+
+
+def render_frames(frames: int):
+    instance = engine.CharPicEngine.from_config({"max_output_frames": frames})
+    stats = {}
+    rendered = list(instance._iter_animated_frames(PILImage.open(io.BytesIO(make_gif(frames))), stats))
+    instance.close()
+    return rendered
+
+
+def encode_imageio(rendered) -> bytes:
+    import imageio
+
+    output = io.BytesIO()
+    imageio.mimsave(output, [frame for frame, _ in rendered], format="gif", duration=[d / 1000 for _, d in rendered])
+    return output.getvalue()
+
+
+def encode_engine(rendered, fmt: str) -> bytes:
+    output = io.BytesIO()
+    writer = engine._open_animation_writer(fmt, output)
+    for frame, duration_ms in rendered:
+        writer.write(frame, duration_ms)
+    writer.close()
+    return output.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=60)
+    args = parser.parse_args()
+
+    logging.getLogger("charpic").setLevel(logging.WARNING)
+    rendered = render_frames(args.frames)
+    encoders = {"imageio gif (原实现)": encode_imageio}
+    for fmt in engine.ANIMATED_OUTPUT_FORMATS:
+        encoders[f"{fmt} 双色"] = lambda frames, fmt=fmt: encode_engine(frames, fmt)
+
+    print(f"{len(rendered)} 帧，帧尺寸 {rendered[0][0].size}")
+    print(f"{'encoder':>20} {'ms':>9} {'bytes':>10}")
+    for name, encode in encoders.items():
+        try:
+            start = time.perf_counter()
+            data = encode(rendered)
+        except ImportError:
+            print(f"{name:>20} {'跳过（未安装 imageio）':>20}")
+            continue
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20} {elapsed * 1000:>9.1f} {len(data):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""下载层验证：在本地 HTTP 服务器上检查条件请求缓存与重试行为
+
+服务器提供带 ETag 的图片 /image.png、只带 Last-Modified 的 /lm.png，
+以及前 N 次返回 503 的 /flaky.png。脚本统计服务器实际发送的正文字节数，
+确认重复请求通过 304 复用缓存、可重试错误在退避后成功。
+用法: python benchmarks/bench_fetch.py [--size 1024x1024] [--repeat N] [--failures N]
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_plugin
+
+plugin = load_plugin()
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def make_png(size) -> bytes:
+    output = io.BytesIO()
+    PILImage.effect_noise(size, 64).save(output, format="PNG")
+    return output.getvalue()
+
+
+class Server:
+    """在后台线程运行的测试服务器，记录请求数、304 次数和发送的正文字节数"""
+
+    def __init__(self, body: bytes, failures: int):
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.failures = failures
+        self.requests = 0
+        self.not_modified = 0
+        self.body_bytes = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                if self.path == "/flaky.png" and server.failures > 0:
+                    server.failures -= 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                validators = {"Last-Modified": LAST_MODIFIED}
+                if self.path != "/lm.png":
+                    validators["ETag"] = server.etag
+                if (
+                    self.headers.get("If-None-Match") == server.etag and "ETag" in validators
+                ) or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                    server.not_modified += 1
+                    self.send_response(304)
+                    for key, value in validators.items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(server.body)))
+                for key, value in validators.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(server.body)
+                server.body_bytes += len(server.body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+async def run(server: Server, repeat: int) -> bool:
+    instance = plugin.CharPicPlugin(None, {"http_retry_backoff": 0.05})
+    await instance.initialize()
+    ok = True
+    try:
+        for path in ("/image.png", "/lm.png"):
+            sent_before = server.body_bytes
+            started = time.perf_counter()
+            first = await instance._download_image(server.url + path)
+            first_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            for _ in range(repeat):
+                again = await instance._download_image(server.url + path)
+                ok &= again == first
+            repeat_ms = (time.perf_counter() - started) * 1000 / repeat
+            sent = server.body_bytes - sent_before
+            print(f"{path}: 首次 {first_ms:6.1f} ms，重复请求平均 {repeat_ms:6.1f} ms，服务器发送正文 {sent} 字节")
+            ok &= first == server.body and sent == len(server.body)
+
+        data = await instance._download_image(server.url + "/flaky.png")
+        print(f"/flaky.png: 重试 {instance.fetcher.stats['retries']} 次后{'成功' if data == server.body else '失败'}")
+        ok &= data == server.body
+        print(f"下载统计: {instance.fetcher.stats}，服务器 304 次数: {server.not_modified}")
+    finally:
+        await instance.terminate()
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="1024x1024")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--failures", type=int, default=2, help="/flaky.png 返回 503 的次数")
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split("x"))
+    server = Server(make_png((width, height)), args.failures)
+    try:
+        ok = asyncio.run(run(server, args.repeat))
+    finally:
+        server.close()
+    if not ok:
+        print("下载层行为与预期不符")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
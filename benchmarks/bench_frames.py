@@ -0,0 +1,69 @@
+"""动图并行帧转换基准：不同帧线程数下处理同一动图的耗时，以及调用线程与帧线程各自的 CPU 时间
+
+并行模式下解码合成、去重和调色板转换仍在调用线程中顺序进行，
+各帧的字符映射、渲染和 GIF 的 LZW 压缩分发到帧线程池。
+调用线程 CPU 时间 (time.thread_time) 是无法并行的部分，帧线程 CPU 时间为进程 CPU 时间减去该部分；
+后者中 LZW 压缩执行时持有 GIL，只能与其他线程中释放 GIL 的解码、缩放和渲染重叠，不能彼此并行。
+加速比需在多核机器上实测，单核机器上耗时不会随线程数下降。
+
+用法: python benchmarks/bench_frames.py [--frames N] [--workers 0 2 4 8] [--format gif] [--color]
+"""
+import argparse
+import io
+import logging
+import os
+import random
+import time
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+
+def make_gif(frames: int, size=(480, 360)) -> bytes:
+    """生成逐帧变化的动图（避免被去重），每帧为平移的噪声图"""
+    rng = random.Random(frames)
+    base = PILImage.frombytes("L", (size[0] * 2, size[1]), rng.randbytes(size[0] * 2 * size[1]))
+    images = [base.crop((i % size[0], 0, i % size[0] + size[0], size[1])).convert("P") for i in range(frames)]
+    output = io.BytesIO()
+    images[0].save(output, format="GIF", save_all=True, append_images=images[1:], duration=50, loop=0)
+    return output.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4, 8])
+    parser.add_argument("--format", default="gif", choices=sorted(engine.ANIMATED_OUTPUT_FORMATS))
+    parser.add_argument("--color", action="store_true", help="彩色字符画")
+    args = parser.parse_args()
+
+    logging.getLogger("charpic").setLevel(logging.WARNING)
+    data = make_gif(args.frames)
+    print(f"{args.frames} 帧动图 -> {args.format}{'（彩色）' if args.color else ''}，CPU 核数 {os.cpu_count()}")
+    print(f"{'workers':>8} {'seconds':>8} {'speedup':>8} {'调用线程 CPU s':>14} {'帧线程 CPU s':>12}")
+    baseline = None
+    output = None
+    for workers in args.workers:
+        instance = engine.CharPicEngine.from_config({
+            "frame_workers": workers, "animation_budget_mpx": 1e9,
+            "max_output_frames": args.frames, "animated_format": args.format,
+        })
+        start, thread_start, process_start = time.perf_counter(), time.thread_time(), time.process_time()
+        result = instance._process_animated_image(PILImage.open(io.BytesIO(data)), color=args.color)
+        elapsed = time.perf_counter() - start
+        serial = time.thread_time() - thread_start
+        total = time.process_time() - process_start
+        instance.close()
+        assert result, f"workers={workers} 处理失败"
+        assert output is None or result == output, f"workers={workers} 输出与顺序模式不一致"
+        output = result
+        baseline = baseline or elapsed
+
+        print(f"{workers:>8} {elapsed:>8.2f} {baseline / elapsed:>7.2f}x {serial:>14.2f} {max(0.0, total - serial):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
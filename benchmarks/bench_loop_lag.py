@@ -0,0 +1,81 @@
+"""事件循环延迟基准：多个动图任务运行时测量事件循环的调度延迟
+
+对比直接在事件循环中同步转换与通过 ConversionPool 转换两种方式。
+用法: python benchmarks/bench_loop_lag.py [--jobs N] [--frames N] [--max-lag-ms MS]
+"""
+import argparse
+import asyncio
+import io
+import random
+import sys
+import time
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_plugin
+
+plugin = load_plugin()
+
+TICK = 0.01
+
+
+def make_gif(frames: int, size=(480, 360)) -> bytes:
+    rng = random.Random(frames)
+    images = [PILImage.frombytes("L", size, rng.randbytes(size[0] * size[1])).convert("P") for _ in range(frames)]
+    output = io.BytesIO()
+    images[0].save(output, format="GIF", save_all=True, append_images=images[1:], duration=80, loop=0)
+    return output.getvalue()
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    """每 TICK 秒唤醒一次，返回观察到的最大延迟（秒）"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        worst = max(worst, time.perf_counter() - start - TICK)
+    return worst
+
+
+async def run_jobs(instance, data: bytes, jobs: int, pooled: bool) -> float:
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0)
+
+    async def one_job():
+        img = PILImage.open(io.BytesIO(data))
+        if pooled:
+            return await instance.pool.run(instance.engine.convert_image, img)
+        return instance.engine.convert_image(img)
+
+    results = await asyncio.gather(*(one_job() for _ in range(jobs)))
+    assert all(result_bytes for result_bytes, _ in results)
+    stop.set()
+    return await ticker
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--max-lag-ms", type=float, default=100.0, help="线程池模式允许的最大延迟")
+    args = parser.parse_args()
+
+    instance = plugin.CharPicPlugin(None, {"max_workers": 2, "max_queue": args.jobs, "job_timeout": 0})
+    data = make_gif(args.frames)
+    try:
+        inline_lag = asyncio.run(run_jobs(instance, data, args.jobs, pooled=False))
+        pooled_lag = asyncio.run(run_jobs(instance, data, args.jobs, pooled=True))
+    finally:
+        instance.pool.shutdown()
+
+    print(f"{args.jobs} 个 {args.frames} 帧动图任务的最大事件循环延迟:")
+    print(f"  事件循环内同步转换: {inline_lag * 1000:8.1f} ms")
+    print(f"  ConversionPool:     {pooled_lag * 1000:8.1f} ms")
+    if pooled_lag * 1000 > args.max_lag_ms:
+        print(f"线程池模式延迟超过阈值 {args.max_lag_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""_get_pic_text 微基准：对比逐像素实现与查找表实现
+
+源图为 4 倍目标宽度，_get_pic_text 会走降分辨率解码（reduce 后再缩放）。
+- 查找表映射与逐像素实现在同一灰度图上逐字节比较；
+- 降分辨率解码的结果不再与"全尺寸转灰度后直接缩放"逐字节一致，
+  按灰度级（STR_MAP 下标）比较二者的差异，超出容差时退出码为 1。
+用法: python benchmarks/bench_pic_text.py [--repeat N]
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+WIDTHS = (80, 150, 300)
+# 降分辨率解码与全尺寸缩放的容差：单个字符最多相差的灰度级数，以及平均相差的灰度级数
+MAX_LEVEL_DIFF = 2
+MAX_MEAN_LEVEL_DIFF = 0.5
+
+
+def legacy_pic_text(img: PILImage.Image) -> str:
+    """原逐像素实现（输入为已缩放的 L 模式图片）"""
+    img = img.convert("L")
+    n = len(engine.STR_MAP)
+    s = ""
+    for x in range(img.height):
+        for y in range(img.width):
+            gray_v = img.getpixel((y, x))
+            s += engine.STR_MAP[int(n * (gray_v / 256))]
+        s += "\n"
+    return s
+
+
+def make_source(width: int) -> PILImage.Image:
+    """生成 4 倍目标宽度的随机 RGB 源图"""
+    rng = random.Random(width)
+    size = (width * 4, width * 3)
+    return PILImage.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+
+
+def gray_levels(img: PILImage.Image) -> np.ndarray:
+    """L 模式图片各像素对应的 STR_MAP 下标"""
+    gray = np.frombuffer(img.tobytes(), dtype=np.uint8).astype(np.int32)
+    return gray * len(engine.STR_MAP) // 256
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    instance = engine.CharPicEngine()
+    ok = True
+    print(f"{'width':>6} {'legacy ms':>10} {'lut ms':>8} {'speedup':>8} {'同字符':>8} {'最大级差':>8} {'平均级差':>8}")
+    for width in WIDTHS:
+        source = make_source(width)
+        new_text = instance._get_pic_text(source, new_w=width)
+        height = len(new_text) // (width + 1)
+
+        # 原实现：全尺寸转灰度后直接缩放到字符网格
+        gray = source.convert("L").resize((width, height))
+        assert engine._gray_to_text(gray) == legacy_pic_text(gray), f"width={width} 查找表映射与逐像素实现不一致"
+
+        # 新实现：降分辨率解码后再缩放，确认比较的正是 _get_pic_text 的输出
+        reduced = engine._decode_for_grid(source.copy(), width, height)
+        if reduced.size != (width, height):
+            reduced = reduced.resize((width, height))
+        assert engine._gray_to_text(reduced) == new_text, f"width={width} 降分辨率路径与 _get_pic_text 不一致"
+
+        level_diff = np.abs(gray_levels(reduced) - gray_levels(gray))
+        same = sum(a == b for a, b in zip(new_text, legacy_pic_text(gray))) / len(new_text)
+        ok &= level_diff.max() <= MAX_LEVEL_DIFF and level_diff.mean() <= MAX_MEAN_LEVEL_DIFF
+
+        legacy = best_of(lambda: legacy_pic_text(gray), args.repeat)
+        lut = best_of(lambda: engine._gray_to_text(gray), args.repeat)
+        print(
+            f"{width:>6} {legacy * 1000:>10.2f} {lut * 1000:>8.3f} {legacy / lut:>7.0f}x "
+            f"{same:>8.1%} {level_diff.max():>8} {level_diff.mean():>8.3f}"
+        )
+    if not ok:
+        print(f"降分辨率解码的输出超出容差（最大 {MAX_LEVEL_DIFF} 级，平均 {MAX_MEAN_LEVEL_DIFF} 级）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""_text_to_image 基准：对比 draw.text 整段绘制与字形图集拼接，并做像素差异校验
+
+用法: python benchmarks/bench_render.py [--repeat N]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from PIL import Image as PILImage, ImageDraw
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+WIDTHS = (80, 150, 300)
+# 允许的差异像素比例（仅来自尺寸裁切差异处的边缘像素）
+MAX_DIFF_RATIO = 0.01
+
+
+def legacy_text_to_image(text: str) -> PILImage.Image:
+    """原实现：测量整段文本后用 draw.text 绘制"""
+    font = engine._load_font(str(engine.DEFAULT_FONT_PATH), engine.FONT_SIZE)
+    bbox = ImageDraw.Draw(PILImage.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    img = PILImage.new("L", (bbox[2] - bbox[0], bbox[3] - bbox[1]), "#FFFFFF")
+    ImageDraw.Draw(img).text((0, 0), text, fill="#000000", font=font)
+    return img
+
+
+def make_text(width: int) -> str:
+    rng = random.Random(width)
+    rows = int(width * 0.75 * engine.FONT_ASPECT_RATIO)
+    return "".join("".join(rng.choice(engine.STR_MAP) for _ in range(width)) + "\n" for _ in range(rows))
+
+
+def diff_ratio(a: PILImage.Image, b: PILImage.Image) -> float:
+    """在公共区域内比较两张图片，返回差异像素比例"""
+    w, h = min(a.width, b.width), min(a.height, b.height)
+    arr_a = np.asarray(a.crop((0, 0, w, h)), dtype=np.int16)
+    arr_b = np.asarray(b.crop((0, 0, w, h)), dtype=np.int16)
+    return float(np.count_nonzero(np.abs(arr_a - arr_b) > 8)) / (w * h)
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    instance = engine.CharPicEngine()
+    print(f"{'width':>6} {'legacy ms':>10} {'atlas ms':>9} {'speedup':>8} {'diff':>7} {'size (legacy -> atlas)':>26}")
+    for width in WIDTHS:
+        text = make_text(width)
+        legacy_img = legacy_text_to_image(text)
+        atlas_img = instance._text_to_image(text)
+        ratio = diff_ratio(legacy_img, atlas_img)
+        assert ratio <= MAX_DIFF_RATIO, f"width={width} 像素差异过大: {ratio:.4f}"
+        legacy = best_of(lambda: legacy_text_to_image(text), args.repeat)
+        atlas = best_of(lambda: instance._text_to_image(text), args.repeat)
+        sizes = f"{legacy_img.size} -> {atlas_img.size}"
+        print(f"{width:>6} {legacy * 1000:>10.2f} {atlas * 1000:>9.2f} {legacy / atlas:>7.1f}x {ratio:>7.4f} {sizes:>26}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""文本输出基准：对比 text/rle 模式与同宽度 PNG 输出的单次转换延迟
+
+文本模式只做解码、缩放和字符映射；PNG 输出还要渲染字形并编码图片。
+分别给出从文件字节开始（含解码）和从已解码图片开始的耗时，后者只反映输出阶段的差异。
+用法: python benchmarks/bench_text_output.py [--size 1280x960] [--widths 40,80,150] [--repeat N]
+"""
+import argparse
+import io
+import logging
+import time
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+
+def make_still(size) -> bytes:
+    gradient = PILImage.linear_gradient("L").resize(size)
+    noise = PILImage.effect_noise(size, 64)
+    output = io.BytesIO()
+    PILImage.merge("RGB", (gradient, noise, gradient)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def best_of(func, repeat: int):
+    result = func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="1280x960")
+    parser.add_argument("--widths", default="40,80,150")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger("charpic").setLevel(logging.ERROR)
+
+    width, height = map(int, args.size.split("x"))
+    data = make_still((width, height))
+    instance = engine.CharPicEngine()
+
+    decoded = PILImage.open(io.BytesIO(data))
+    decoded.load()
+    sources = {"含解码": lambda: PILImage.open(io.BytesIO(data)), "已解码": decoded.copy}
+
+    def png_output(source, char_width: int) -> bytes:
+        return instance.render_text_png(instance._get_pic_text(source(), char_width))
+
+    def text_output(source, options) -> bytes:
+        return instance.convert_image(source(), options)[0]
+
+    print(f"{width}x{height} 静态图，单次转换最快耗时:")
+    print(f"{'输入':>6} {'宽度':>6} {'模式':>6} {'耗时 ms':>10} {'输出字节':>10} {'相对 PNG':>10}")
+    try:
+        for label, source in sources.items():
+            for char_width in map(int, args.widths.split(",")):
+                png_seconds, png_bytes = best_of(lambda: png_output(source, char_width), args.repeat)
+                print(f"{label:>6} {char_width:>6} {'png':>6} {png_seconds * 1000:>10.2f} {len(png_bytes):>10} {1.0:>9.1f}x")
+                for mode in ("text", "rle"):
+                    options = engine.OutputOptions(mode, char_width)
+                    seconds, result = best_of(lambda: text_output(source, options), args.repeat)
+                    print(
+                        f"{label:>6} {char_width:>6} {mode:>6} {seconds * 1000:>10.2f} {len(result):>10} "
+                        f"{png_seconds / seconds:>9.1f}x"
+                    )
+    finally:
+        instance.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""视频输入基准：用 ffmpeg 生成不同时长的测试视频，测量转换耗时、输出帧数和内存峰值
+
+视频与插件处理本地文件和下载结果时一样以 VideoFile 交给引擎，ffmpeg 直接读取文件；
+按 video_fps 抽样、按 max_video_seconds 截断后流式解码，输出帧数和 Python 侧内存峰值应与视频总长度无关。
+用法: python benchmarks/bench_video.py [--size 1280x720] [--lengths 2,10,60] [--fps 25] [--container mp4]
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image as PILImage
+
+from _astrbot_stub import load_engine
+
+engine = load_engine()
+
+CODECS = {"mp4": "libx264", "webm": "libvpx"}
+
+
+def make_video(path: str, size, seconds: float, fps: int, container: str):
+    """生成一段移动渐变的测试视频并写入 path"""
+    width, height = size
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)[:, None]
+    writer = imageio_ffmpeg.write_frames(
+        path, size, fps=fps, codec=CODECS[container], macro_block_size=1,
+        output_params=["-loglevel", "error"],
+    )
+    writer.send(None)
+    for index in range(round(seconds * fps)):
+        luma = ((x + y + index * 8) % 256).astype(np.uint8)
+        frame = np.dstack([luma, np.broadcast_to(luma[:, :1], luma.shape), 255 - luma])
+        writer.send(np.ascontiguousarray(frame))
+    writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--lengths", default="2,10,60", help="视频时长（秒），逗号分隔")
+    parser.add_argument("--fps", type=int, default=25, help="测试视频本身的帧率")
+    parser.add_argument("--container", choices=sorted(CODECS), default="mp4")
+    args = parser.parse_args()
+    logging.getLogger("charpic").setLevel(logging.ERROR)
+
+    width, height = map(int, args.size.split("x"))
+    instance = engine.CharPicEngine()
+    limit = min(
+        round(instance.video_fps * instance.max_video_seconds), instance.animation_policy.max_output_frames
+    )
+    print(
+        f"{width}x{height}@{args.fps} {args.container}，抽样 {instance.video_fps:g} fps，"
+        f"最长 {instance.max_video_seconds:g}s（最多 {limit} 帧）"
+    )
+    print(f"{'时长 s':>8} {'视频字节':>10} {'耗时 ms':>10} {'输出帧':>8} {'输出字节':>10} {'内存峰值 MB':>12}")
+    ok = True
+    tmp = tempfile.TemporaryDirectory()
+    try:
+        for seconds in map(float, args.lengths.split(",")):
+            path = os.path.join(tmp.name, f"clip-{seconds:g}.{args.container}")
+            make_video(path, (width, height), seconds, args.fps, args.container)
+            tracemalloc.start()
+            started = time.perf_counter()
+            video = engine.open_video_file(path)
+            ok &= video is not None and video.ext == args.container
+            result, ext = instance.convert_video(video)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if result is None:
+                print(f"{seconds:>8g} 转换失败")
+                ok = False
+                continue
+            frames = getattr(PILImage.open(io.BytesIO(result)), "n_frames", 1)
+            ok &= 1 < frames <= limit
+            print(
+                f"{seconds:>8g} {video.size:>10} {elapsed * 1000:>10.1f} {frames:>8} {len(result):>10} "
+                f"{peak / 1e6:>12.1f}"
+            )
+    finally:
+        instance.close()
+        instance.scratch.cleanup()
+        tmp.cleanup()
+    if not ok:
+        print("视频输出与预期不符")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""可复现的字符画转换流水线基准套件
+
+直接调用转换引擎（engine.py）的方法，使用固定随机种子生成的合成输入：
+多种尺寸的静态图，以及帧数和重复帧比例各不相同的 GIF/APNG/WebP 动图。
+分别计时 _get_pic_text、_text_to_image、_process_static_image、_process_animated_image，
+记录吞吐、峰值 RSS 和输出字节数，结果以 JSON 输出，便于跨提交比较。
+
+每个用例（含输入生成）在独立子进程中运行，使峰值 RSS 互不影响。
+
+用法:
+    python benchmarks/run.py --output result.json
+    python benchmarks/run.py --baseline result.json --threshold 0.15   # 回归检测，变慢超过阈值时退出码为 1
+    python benchmarks/run.py --filter animated --repeat 5
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from PIL import Image as PILImage
+
+from _astrbot_stub import PLUGIN_DIR, load_engine
+
+# 用例名 -> 参数
+CASES: Dict[str, dict] = {}
+for _w, _h in ((320, 240), (1280, 960), (4000, 3000)):
+    CASES[f"pic_text/{_w}x{_h}"] = {"op": "pic_text", "size": (_w, _h)}
+    for _fmt in ("JPEG", "PNG"):
+        CASES[f"static/{_fmt.lower()}/{_w}x{_h}"] = {"op": "static", "size": (_w, _h), "format": _fmt}
+    CASES[f"static_color/png/{_w}x{_h}"] = {"op": "static", "size": (_w, _h), "format": "PNG", "color": True}
+    for _mode in ("text", "rle"):
+        CASES[f"{_mode}/{_w}x{_h}"] = {"op": "text", "size": (_w, _h), "mode": _mode}
+for _cols in (80, 150, 300):
+    CASES[f"render/{_cols}cols"] = {"op": "render", "cols": _cols}
+for _fmt in ("GIF", "PNG", "WEBP"):
+    for _frames in (10, 60, 200):
+        for _dup in (0.0, 0.5):
+            CASES[f"animated/{_fmt.lower()}/{_frames}f/dup{int(_dup * 100)}"] = {
+                "op": "animated", "size": (320, 240), "format": _fmt, "frames": _frames, "dup": _dup,
+            }
+    CASES[f"animated_color/{_fmt.lower()}/60f"] = {
+        "op": "animated", "size": (320, 240), "format": _fmt, "frames": 60, "dup": 0.0, "color": True,
+    }
+
+
+def make_still(size, fmt: str) -> bytes:
+    """渐变 + 噪声的静态图"""
+    gradient = PILImage.linear_gradient("L").resize(size)
+    noise = PILImage.effect_noise(size, 64)
+    img = PILImage.merge("RGB", (gradient, noise, gradient.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)))
+    output = io.BytesIO()
+    img.save(output, format=fmt)
+    return output.getvalue()
+
+
+def make_animation(size, fmt: str, frames: int, dup: float) -> bytes:
+    """平移噪声组成的动图，按 dup 比例让帧重复上一帧的内容
+
+    重复帧在左上角改动一个像素，避免被编码器自行合并，但字符网格保持不变。
+    """
+    rng = random.Random(frames)
+    base = PILImage.frombytes("L", (size[0] * 2, size[1]), rng.randbytes(size[0] * 2 * size[1])).convert("RGB")
+    images: List[PILImage.Image] = []
+    offset = 0
+    for idx in range(frames):
+        if idx and rng.random() < dup:
+            frame = images[-1].copy()
+            frame.putpixel((0, 0), (idx % 256, 0, 0))
+        else:
+            offset = (offset + 7) % size[0]
+            frame = base.crop((offset, 0, offset + size[0], size[1]))
+        images.append(frame)
+    output = io.BytesIO()
+    images[0].save(output, format=fmt, save_all=True, append_images=images[1:], duration=50, loop=0)
+    return output.getvalue()
+
+
+def best_of(func, repeat: int):
+    """先预热一次（字体与字形图集加载），再取 repeat 次中最快的一次"""
+    result = func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_case(name: str, repeat: int) -> dict:
+    """在当前进程中运行单个用例"""
+    engine = load_engine()
+    logging.getLogger("charpic").setLevel(logging.ERROR)
+    instance = engine.CharPicEngine.from_config({"animation_budget_mpx": 1e9, "max_output_frames": 10_000})
+    case = CASES[name]
+    op = case["op"]
+    try:
+        if op == "pic_text":
+            img = PILImage.open(io.BytesIO(make_still(case["size"], "PNG")))
+            img.load()
+            seconds, text = best_of(lambda: instance._get_pic_text(img), repeat)
+            units, unit, output_bytes = 1, "calls", len(text)
+        elif op == "render":
+            rng = random.Random(case["cols"])
+            rows = int(case["cols"] * 0.75 * engine.FONT_ASPECT_RATIO)
+            text = "".join("".join(rng.choice(engine.STR_MAP) for _ in range(case["cols"])) + "\n" for _ in range(rows))
+            seconds, img = best_of(lambda: instance._text_to_image(text), repeat)
+            units, unit, output_bytes = 1, "calls", len(img.tobytes())
+        elif op == "text":
+            data = make_still(case["size"], "PNG")
+            options = engine.OutputOptions(case["mode"], engine.DEFAULT_TEXT_CHAR_WIDTH)
+            seconds, result = best_of(lambda: instance.convert_image(PILImage.open(io.BytesIO(data)), options), repeat)
+            units, unit, output_bytes = case["size"][0] * case["size"][1] / 1e6, "MPx", len(result[0] or b"")
+        elif op == "static":
+            data = make_still(case["size"], case["format"])
+            seconds, result = best_of(
+                lambda: instance._process_static_image(PILImage.open(io.BytesIO(data)), case.get("color", False)), repeat
+            )
+            units, unit, output_bytes = case["size"][0] * case["size"][1] / 1e6, "MPx", len(result or b"")
+        else:
+            data = make_animation(case["size"], case["format"], case["frames"], case["dup"])
+            seconds, result = best_of(
+                lambda: instance._process_animated_image(PILImage.open(io.BytesIO(data)), color=case.get("color", False)),
+                repeat,
+            )
+            units, unit, output_bytes = case["frames"], "frames", len(result or b"")
+    finally:
+        instance.close()
+
+    return {
+        "seconds": seconds,
+        "throughput": units / seconds if seconds else 0.0,
+        "throughput_unit": f"{unit}/s",
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_bytes": output_bytes,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PLUGIN_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import PIL
+    import numpy
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """返回耗时相对基线增加超过 threshold 的用例说明"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("seconds"):
+            continue
+        ratio = result["seconds"] / base["seconds"] - 1
+        if ratio > threshold:
+            regressions.append(f"{name}: {base['seconds'] * 1000:.1f} ms -> {result['seconds'] * 1000:.1f} ms (+{ratio:.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取最快一次")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前保存的 JSON 结果比较")
+    parser.add_argument("--threshold", type=float, default=0.15, help="回归阈值（耗时增加比例）")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.repeat)))
+        return
+
+    results: Dict[str, dict] = {}
+    for name in CASES:
+        if args.filter not in name:
+            continue
+        output = subprocess.run(
+            [sys.executable, __file__, "--case", name, "--repeat", str(args.repeat)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+        r = results[name]
+        print(
+            f"{name:<32} {r['seconds'] * 1000:>9.1f} ms {r['throughput']:>10.1f} {r['throughput_unit']:<9}"
+            f" {r['peak_rss_mb']:>7.1f} MB {r['output_bytes']:>10} B",
+            file=sys.stderr,
+        )
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 个性能回归（阈值 {args.threshold:.0%}）:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("未发现性能回归", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
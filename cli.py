@@ -0,0 +1,248 @@
+"""命令行批量转换：将目录或通配符匹配的图片（及短视频）转换为字符画，可同时预热插件的结果缓存
+
+不依赖 AstrBot，直接使用转换引擎（engine.py）；转换在多进程池中并行进行，每个进程各持有一个引擎。
+渲染参数取自 --config 指定的插件配置文件（缺省时使用默认值），与插件配置一致时缓存键也一致：
+指定 --cache-dir（或配置中的 cache_disk_dir）后，插件启动时即可直接命中预热的结果。
+
+用法:
+    python cli.py 图片目录/ -o 输出目录/
+    python cli.py "albums/**/*.gif" --mode color -j 4 -o out/
+    python cli.py 图片目录/ --config data/config/charpic_config.json --cache-dir /data/charpic-cache
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from engine import (
+    DEFAULT_CACHE_DISK_MB,
+    OUTPUT_MODE_ALIASES,
+    CharPicEngine,
+    ImageRejected,
+    OutputOptions,
+    ResultCache,
+    SourceData,
+    open_video_file,
+    parse_output_options,
+)
+
+# 扫描目录时收录的文件扩展名（实际格式按文件头识别）
+INPUT_SUFFIXES = {
+    ".png", ".apng", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tif", ".tiff", ".mng",
+    ".mp4", ".m4v", ".mov", ".webm", ".mkv",
+}
+
+
+class Job(NamedTuple):
+    """单个输入文件的转换任务"""
+    path: Path
+    output: Optional[Path]  # 输出路径（扩展名按结果替换），None 表示只写入缓存
+    cache_key: Optional[str]
+
+
+class JobResult(NamedTuple):
+    job: Job
+    data: Optional[bytes]
+    ext: str
+    seconds: float
+    error: str
+
+
+# 工作进程内的转换引擎与输出形式，由 _init_worker 创建
+_worker_engine: Optional[CharPicEngine] = None
+_worker_options: Optional[OutputOptions] = None
+
+
+def _setup_logging(level: int):
+    logging.basicConfig(level=level, format="%(levelname)s %(message)s")
+    # 视频按 VIDEO_DECODE_WIDTH 缩小解码是预期行为，不输出 imageio-ffmpeg 的尺寸提示
+    logging.getLogger("imageio_ffmpeg").setLevel(logging.ERROR)
+
+
+def _init_worker(config: Dict[str, Any], options: OutputOptions, log_level: int):
+    global _worker_engine, _worker_options
+    _setup_logging(log_level)
+    _worker_engine = CharPicEngine.from_config(config)
+    _worker_options = options
+    # 进程正常退出时删除视频解码用的临时目录
+    multiprocessing.util.Finalize(_worker_engine, _worker_engine.scratch.cleanup, exitpriority=0)
+
+
+def _read_source(path: Path) -> SourceData:
+    """读取输入文件；视频只计算内容哈希，由 ffmpeg 直接读取原文件"""
+    return open_video_file(str(path)) or path.read_bytes()
+
+
+def _convert_file(job: Job) -> JobResult:
+    """在工作进程中转换一个文件，错误以字符串返回而不是抛出"""
+    started = time.perf_counter()
+    data, ext, error = None, "", ""
+    try:
+        data, ext = _worker_engine.convert(_read_source(job.path), _worker_options)
+        if not data:
+            error = "转换失败"
+    except ImageRejected as e:
+        error = str(e)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return JobResult(job, data, ext, time.perf_counter() - started, error)
+
+
+def _collect_inputs(patterns: List[str]) -> List[Tuple[Path, Path]]:
+    """展开目录与通配符，返回 (输入路径, 相对输出路径)；目录保留子目录结构"""
+    inputs: Dict[Path, Path] = {}
+    for pattern in patterns:
+        root = Path(pattern)
+        if root.is_dir():
+            for path in sorted(root.rglob("*")):
+                if path.is_file() and path.suffix.lower() in INPUT_SUFFIXES:
+                    inputs.setdefault(path, path.relative_to(root))
+            continue
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            path = Path(match)
+            if path.is_file():
+                inputs.setdefault(path, Path(path.name))
+    return list(inputs.items())
+
+
+def _load_config(path: Optional[str]) -> Dict[str, Any]:
+    """读取 AstrBot 保存的插件配置（JSON），未指定时使用默认配置"""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def _write_output(result: JobResult):
+    output = result.job.output.with_suffix(f".{result.ext}")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(result.data)
+
+
+def _report(done: int, total: int, status: str, seconds: float, path: Path, detail: str = ""):
+    """输出一行进度到 stderr"""
+    width = len(str(total))
+    suffix = f"  {detail}" if detail else ""
+    print(f"[{done:>{width}}/{total}] {status:<6} {seconds * 1000:9.1f} ms  {path}{suffix}", file=sys.stderr, flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="图片/视频文件、目录或通配符（支持 **）")
+    parser.add_argument("-o", "--output", help="输出目录；不指定时只写入缓存")
+    parser.add_argument("--mode", default="image", choices=["image"] + sorted(OUTPUT_MODE_ALIASES), help="输出形式，默认 image")
+    parser.add_argument("--char-width", type=int, help="text/rle 模式的字符宽度")
+    parser.add_argument("--config", help="插件配置文件（JSON），渲染参数和缓存设置与插件保持一致")
+    parser.add_argument("--animated-format", help="覆盖配置中的动图输出格式（gif/webp/apng）")
+    parser.add_argument("--cache-dir", help="预热的磁盘缓存目录，默认取配置中的 cache_disk_dir")
+    parser.add_argument("--cache-mb", type=float, help="磁盘缓存上限（MB），默认取配置中的 cache_disk_mb")
+    parser.add_argument("--force", action="store_true", help="忽略已有缓存，重新转换")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并行进程数，默认为 CPU 核数")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只输出汇总和错误")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出引擎的处理日志")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    _setup_logging(log_level)
+
+    config = _load_config(args.config)
+    if args.animated_format:
+        config["animated_format"] = args.animated_format
+    cache_dir = args.cache_dir or config.get("cache_disk_dir") or None
+    if not args.output and not cache_dir:
+        parser.error("需要指定 --output 或 --cache-dir")
+    options = parse_output_options([args.mode] + ([str(args.char_width)] if args.char_width else []))
+
+    inputs = _collect_inputs(args.inputs)
+    if not inputs:
+        print("没有找到输入文件", file=sys.stderr)
+        return 1
+
+    cache = None
+    params = ""
+    if cache_dir:
+        cache_mb = args.cache_mb if args.cache_mb is not None else float(config.get("cache_disk_mb", DEFAULT_CACHE_DISK_MB))
+        cache = ResultCache(memory_budget=0, disk_dir=cache_dir, disk_budget=int(cache_mb * 1024 * 1024))
+        if cache.disk_dir is None:
+            print(f"缓存目录不可用: {cache_dir}", file=sys.stderr)
+            return 1
+        engine = CharPicEngine.from_config(config)
+        params = engine.cache_params(options)
+        engine.close()
+
+    total = len(inputs)
+    done = converted = cached = failed = 0
+    started = time.perf_counter()
+
+    # 已在缓存中的文件直接取缓存结果（只预热缓存时跳过），其余提交到进程池
+    jobs: List[Job] = []
+    for path, relative in inputs:
+        output = Path(args.output) / relative if args.output else None
+        key = None
+        if cache is not None:
+            try:
+                key = ResultCache.make_key(_read_source(path), params)
+            except OSError as e:
+                done += 1
+                failed += 1
+                _report(done, total, "失败", 0.0, path, str(e))
+                continue
+            if not args.force and cache.contains(key):
+                item = cache.get(key) if output is not None else None
+                if output is None or item is not None:
+                    done += 1
+                    cached += 1
+                    if item is not None:
+                        _write_output(JobResult(Job(path, output, key), item[0], item[1], 0.0, ""))
+                    if not args.quiet:
+                        _report(done, total, "缓存", 0.0, path)
+                    continue
+        jobs.append(Job(path, output, key))
+
+    processes = max(1, min(args.jobs, len(jobs))) if jobs else 0
+    if jobs:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(config, options, log_level))
+        try:
+            for result in pool.imap_unordered(_convert_file, jobs):
+                done += 1
+                if result.error:
+                    failed += 1
+                    _report(done, total, "失败", result.seconds, result.job.path, result.error)
+                    continue
+                converted += 1
+                if result.job.output is not None:
+                    _write_output(result)
+                if cache is not None:
+                    cache.put(result.job.cache_key, result.data, result.ext)
+                if not args.quiet:
+                    _report(done, total, "完成", result.seconds, result.job.path)
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"共 {total} 个文件：转换 {converted}，命中缓存 {cached}，失败 {failed}，"
+        f"用时 {elapsed:.1f}s（{converted / elapsed if elapsed else 0.0:.1f} 个/秒，{processes} 进程）",
+        file=sys.stderr,
+    )
+    if cache is not None:
+        stats = cache.stats()
+        print(f"缓存目录 {cache.disk_dir}：{stats['disk_entries']} 项，{stats['disk_bytes']} 字节", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
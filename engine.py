@@ -0,0 +1,1667 @@
+"""字符画转换引擎
+
+字符映射（STR_MAP）、缩放策略、字形渲染以及静态图/动图/视频的编码，不依赖 AstrBot：
+插件（main.py）、命令行批量转换（cli.py）和基准脚本共用同一实现。
+"""
+import io
+import contextvars
+import hashlib
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from PIL import GifImagePlugin, Image as PILImage, ImageChops, ImageDraw, ImageFont
+try:
+    import imageio_ffmpeg
+except ImportError:
+    imageio_ffmpeg = None
+
+# 默认使用标准 logging；作为 AstrBot 插件加载时由 main.py 换成 AstrBot 的 logger
+logger = logging.getLogger("charpic")
+
+
+def set_logger(new_logger: logging.Logger):
+    """替换引擎使用的 logger"""
+    global logger
+    logger = new_logger
+
+
+# 字体配置
+DEFAULT_FONT_PATH = Path(__file__).parent / "font" / "consola.ttf"
+FONT_SIZE = 14
+# 字符画宽度（字符数）
+STATIC_CHAR_WIDTH = 150
+ANIMATED_CHAR_WIDTH = 80
+# 字体宽高比补偿系数 (字符宽度/字符高度)
+# 大多数等宽字体的宽度约为高度的 0.5-0.6 倍
+FONT_ASPECT_RATIO = 0.55
+
+# 动图逐帧并行转换的线程数，0 或 1 表示在任务线程内顺序转换
+DEFAULT_FRAME_WORKERS = 0
+# 每个帧线程允许同时在途的帧数，限制并行模式下的内存占用
+FRAME_WINDOW_PER_WORKER = 2
+
+# 动图预算默认配置（可在插件配置中覆盖）
+DEFAULT_ANIMATION_BUDGET_MPX = 300.0
+DEFAULT_MAX_OUTPUT_FRAMES = 300
+DEFAULT_MAX_FRAME_STRIDE = 4
+DEFAULT_MIN_CHAR_WIDTH = 40
+
+# 结果缓存默认配置（可在插件配置中覆盖）
+DEFAULT_CACHE_MEMORY_MB = 32
+DEFAULT_CACHE_DISK_MB = 256
+
+# 输出模式：text 直接发送字符文本，rle 用 ANSI REP 转义压缩连续重复字符，color 输出彩色字符画图片
+OUTPUT_MODE_ALIASES = {
+    "text": "text", "文本": "text",
+    "rle": "rle", "ansi": "rle", "压缩": "rle",
+    "color": "color", "彩色": "color",
+}
+TEXT_OUTPUT_EXTS = {"text": "txt", "rle": "ansi"}
+DEFAULT_TEXT_CHAR_WIDTH = 40
+MIN_TEXT_CHAR_WIDTH = 8
+
+# 临时目录前缀（文件发送与视频解码共用）；优先放在内存文件系统 /dev/shm 中
+SCRATCH_PREFIX = "charpic-scratch-"
+SCRATCH_ROOTS = ("/dev/shm",)
+
+# 视频输入默认配置（可在插件配置中覆盖）：抽样帧率、处理时长上限（秒）
+DEFAULT_VIDEO_FPS = 10.0
+DEFAULT_MAX_VIDEO_SECONDS = 15.0
+# ffmpeg 解码后直接缩小到的最大宽度（动图字符宽度的 DECODE_OVERSAMPLE 倍）
+VIDEO_DECODE_WIDTH = 160
+# 准入估算时假定的解码帧尺寸：按常见的竖屏手机视频（9:16）取最坏情况，横屏视频会被高估
+VIDEO_ESTIMATE_FRAME_SIZE = (VIDEO_DECODE_WIDTH, VIDEO_DECODE_WIDTH * 16 // 9)
+
+# 字符映射
+STR_MAP = "@@$$&B88QMMGW##EE93SPPDOOU**==()+^,\"--''.  "
+
+
+def _build_char_lut(str_map: str) -> bytes:
+    """构建 256 项灰度->字符查找表，与逐像素公式 STR_MAP[int(n * (gray / 256))] 完全一致"""
+    n = len(str_map)
+    return bytes(ord(str_map[int(n * (gray_v / 256))]) for gray_v in range(256))
+
+
+# 灰度->字符查找表（STR_MAP 仅包含 ASCII 字符，可直接用于 bytes.translate）
+CHAR_LUT = _build_char_lut(STR_MAP)
+
+
+def _gray_to_text(img: PILImage.Image) -> str:
+    """将 L 模式图片整体映射为字符文本（每行以换行符结尾）"""
+    w = img.width
+    data = img.tobytes().translate(CHAR_LUT)
+    rows = [data[i:i + w] for i in range(0, len(data), w)]
+    rows.append(b"")
+    return b"\n".join(rows).decode("ascii")
+
+
+def _char_grid_size(w: int, h: int, new_w: int, enforce_target_width: bool) -> Tuple[int, int]:
+    """根据源图尺寸计算字符网格的列数和行数"""
+    target_w = w
+    if new_w:
+        if enforce_target_width or w > new_w:
+            target_w = max(1, new_w)
+
+    scale = target_w / w if w else 1
+    target_h = max(1, int(h * scale * FONT_ASPECT_RATIO))
+    return target_w, target_h
+
+
+class OutputOptions(NamedTuple):
+    """输出形式：mode 为 image/color/text/rle，char_width 为文本模式的字符宽度"""
+    mode: str = "image"
+    char_width: int = STATIC_CHAR_WIDTH
+
+
+IMAGE_OUTPUT = OutputOptions()
+
+# 连续重复至少该次数的字符才值得替换为 REP 转义（字符 + ESC [ n b）
+ANSI_REP_MIN_RUN = 6
+_RUN_PATTERN = re.compile(r"([^\n])\1{%d,}" % (ANSI_REP_MIN_RUN - 1))
+_REP_PATTERN = re.compile(r"([^\n])\x1b\[(\d+)b")
+
+
+def _compress_runs(text: str) -> str:
+    """将每行中的连续重复字符压缩为 ANSI REP 转义（CSI n b：重复前一字符 n 次）"""
+    return _RUN_PATTERN.sub(lambda m: f"{m.group(1)}\x1b[{len(m.group(0)) - 1}b", text)
+
+
+def expand_runs(text: str) -> str:
+    """还原 _compress_runs 压缩的文本"""
+    return _REP_PATTERN.sub(lambda m: m.group(1) * (int(m.group(2)) + 1), text)
+
+
+class AnimationPolicy(NamedTuple):
+    """动图工作量预算策略"""
+    budget_mpx: float  # 单个动图允许处理的总像素量（百万像素）
+    max_output_frames: int  # 输出帧数上限
+    max_stride: int  # 优先通过抽帧控制预算的最大抽帧间隔，超过后开始降低字符宽度
+    min_char_width: int  # 字符宽度下限
+
+
+# 被抽掉的帧仍需顺序解码合成，其成本相对完整处理一帧的权重
+SKIPPED_FRAME_COST_WEIGHT = 0.25
+# 降低字符宽度时的步长
+CHAR_WIDTH_STEP = 10
+
+
+def _animation_cost(frame_count: int, src_size: Tuple[int, int], cell_size: Tuple[int, int], stride: int, char_width: int) -> float:
+    """估算动图处理的总像素工作量
+
+    所有源帧都要解码；保留的帧还要转换灰度并渲染为 (列 x 单元宽) x (行 x 单元高) 的输出帧。
+    """
+    src_px = src_size[0] * src_size[1]
+    cols, rows = _char_grid_size(src_size[0], src_size[1], char_width, True)
+    kept = math.ceil(frame_count / stride)
+    out_px = cols * cell_size[0] * rows * cell_size[1]
+    return frame_count * src_px * SKIPPED_FRAME_COST_WEIGHT + kept * (src_px + out_px)
+
+
+def _plan_animation(
+    policy: AnimationPolicy, frame_count: int, src_size: Tuple[int, int], cell_size: Tuple[int, int]
+) -> Optional[Tuple[int, int]]:
+    """根据成本模型选择 (抽帧间隔, 字符宽度)，使总工作量不超过预算
+
+    先按输出帧数上限确定最小抽帧间隔；超出预算时优先增大抽帧间隔（至 max_stride），
+    再逐步降低字符宽度（至 min_char_width），最后继续增大抽帧间隔。
+    仅解码全部源帧就超出预算时返回 None。
+    """
+    budget = policy.budget_mpx * 1_000_000
+    if frame_count * src_size[0] * src_size[1] * SKIPPED_FRAME_COST_WEIGHT > budget:
+        return None
+
+    char_width = ANIMATED_CHAR_WIDTH
+    min_width = max(1, min(policy.min_char_width, ANIMATED_CHAR_WIDTH))
+    stride = max(1, math.ceil(frame_count / max(1, policy.max_output_frames)))
+    while _animation_cost(frame_count, src_size, cell_size, stride, char_width) > budget:
+        if stride < policy.max_stride:
+            stride += 1
+        elif char_width > min_width:
+            char_width = max(min_width, char_width - CHAR_WIDTH_STEP)
+        elif stride < frame_count:
+            stride += 1
+        else:
+            return None
+    return stride, char_width
+
+
+# 降分辨率解码时保留的超采样倍数（相对字符网格尺寸）
+DECODE_OVERSAMPLE = 2
+# Image.reduce 支持的模式，其他模式先转换为 L 再缩小
+REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "RGBX"}
+
+
+def _decode_for_grid(img: PILImage.Image, target_w: int, target_h: int, mode: str = "L") -> PILImage.Image:
+    """以足够生成字符网格的最小分辨率解码图片，返回 mode（L 或 RGB）模式图片
+
+    JPEG 在解码前通过 draft() 使用 DCT 缩放直接解码为缩小后的图片；
+    其他格式解码后先用 reduce() 做整数倍盒式缩小，再转换模式，
+    使后续的模式转换和 resize 只处理接近目标尺寸的像素。
+    """
+    min_w = target_w * DECODE_OVERSAMPLE
+    min_h = target_h * DECODE_OVERSAMPLE
+    with timed_stage("decode"):
+        if img.format == "JPEG":
+            # draft 只会选择不小于请求尺寸的缩放比例，且对已解码的图片无效
+            img.draft(mode, (min_w, min_h))
+        img.load()
+
+    with timed_stage("gray_resize"):
+        if img.mode not in REDUCIBLE_MODES:
+            img = img.convert(mode)
+        factor_x = max(1, img.width // min_w)
+        factor_y = max(1, img.height // min_h)
+        if factor_x > 1 or factor_y > 1:
+            img = img.reduce((factor_x, factor_y))
+        return img.convert(mode)
+
+
+# 字形图集覆盖的字符（可打印 ASCII，包含 STR_MAP 的全部字符）
+ATLAS_CHARS = "".join(chr(c) for c in range(32, 127))
+# 字符->图集下标查找表，图集外的字符按空格处理
+ATLAS_INDEX_LUT = bytes(c - 32 if 32 <= c < 127 else 0 for c in range(256))
+
+
+# 彩色 GIF 共享调色板的颜色数
+COLOR_PALETTE_SIZE = 256
+# 多图拼图中各结果之间的间距（像素）
+CONTACT_SHEET_GAP = 16
+
+# 动图输出帧使用的双色调色板（索引 0 为黑色字形，索引 1 为白色背景）
+BINARY_PALETTE = [0, 0, 0, 255, 255, 255]
+# L 模式渲染帧 -> 调色板索引的阈值映射表
+BINARY_LUT = [0 if v < 128 else 1 for v in range(256)]
+
+# 支持的动图输出格式 -> (Pillow 格式名, 文件扩展名)
+ANIMATED_OUTPUT_FORMATS = {
+    "gif": ("GIF", "gif"),
+    "webp": ("WEBP", "webp"),
+    "apng": ("PNG", "png"),
+}
+DEFAULT_ANIMATED_FORMAT = "gif"
+
+
+def _binarize_frame(frame: PILImage.Image) -> PILImage.Image:
+    """将 L 模式渲染帧转换为双色调色板图片"""
+    binary = frame.point(BINARY_LUT)
+    binary.putpalette(BINARY_PALETTE)
+    return binary
+
+
+def _palette_indices(frame: PILImage.Image) -> PILImage.Image:
+    """以 L 模式图片的形式取出调色板图片的像素索引，用于比较相邻帧"""
+    return PILImage.frombytes("L", frame.size, frame.tobytes())
+
+
+class GifStreamWriter:
+    """增量写出 GIF：首帧写入文件头，之后每帧编码后直接追加，不在内存中保留帧
+
+    L 模式帧编码为双色；RGB（彩色）帧映射到由首帧自适应生成的共享全局调色板，
+    各帧不再携带局部调色板。
+    除首帧外，每帧只写入与上一帧相比发生变化的矩形区域，
+    并使用 disposal=1（保留上一帧）叠加到画布上。
+    给出 executor 时各帧变化区域的 LZW 压缩（编码中最耗时的部分）分发到该线程池，
+    最多 window 帧同时在途，压缩结果按帧顺序写出。
+    压缩执行时几乎全程持有 GIL，只能与其他线程中释放 GIL 的解码、缩放和渲染重叠，多个压缩任务之间不能并行。
+    """
+
+    def __init__(self, fp: BinaryIO, loop: int = 0, executor: Optional[ThreadPoolExecutor] = None, window: int = 0):
+        self.fp = fp
+        self.loop = loop
+        self.frame_count = 0
+        self._previous: Optional[PILImage.Image] = None
+        self._palette: Optional[PILImage.Image] = None
+        self._executor = executor
+        self._window = window
+        self._pending: "deque[Future]" = deque()
+
+    def _to_palette(self, frame: PILImage.Image) -> PILImage.Image:
+        """将渲染帧转换为调色板图片"""
+        if frame.mode == "L":
+            return _binarize_frame(frame)
+        if self._palette is None:
+            # 由首帧自适应生成的调色板作为全部帧共享的全局调色板
+            self._palette = frame.quantize(COLOR_PALETTE_SIZE, method=PILImage.Quantize.FASTOCTREE)
+            return self._palette
+        return frame.quantize(palette=self._palette, dither=PILImage.Dither.NONE)
+
+    def write(self, frame: PILImage.Image, duration_ms: int):
+        """写入一帧 L 模式（双色）或 RGB 模式（彩色）图片"""
+        indexed = self._to_palette(frame)
+        offset = (0, 0)
+        patch = indexed
+        indices = _palette_indices(indexed)
+        if self._previous is None:
+            header, _ = GifImagePlugin.getheader(indexed.copy(), info={"loop": self.loop})
+            for chunk in header:
+                self.fp.write(chunk)
+        else:
+            # 画面无变化时仍写入 1x1 的区域以保留该帧的延迟
+            bbox = ImageChops.difference(indices, self._previous).getbbox() or (0, 0, 1, 1)
+            offset = bbox[:2]
+            patch = indexed.crop(bbox)
+        self._previous = indices
+
+        # GIF 帧延迟以 10ms 为单位存储为 16 位整数，合并后的长延迟需截断
+        duration_ms = min(duration_ms, 655350)
+        if self._executor is None:
+            self.fp.write(self._encode_patch(patch, offset, duration_ms))
+        else:
+            self._pending.append(self._executor.submit(self._encode_patch, patch, offset, duration_ms))
+            while len(self._pending) > self._window:
+                self.fp.write(self._pending.popleft().result())
+        self.frame_count += 1
+
+    @staticmethod
+    def _encode_patch(patch: PILImage.Image, offset: Tuple[int, int], duration_ms: int) -> bytes:
+        """压缩一帧的变化区域，返回该帧的图像描述块和数据块"""
+        return b"".join(GifImagePlugin.getdata(patch, offset=offset, duration=duration_ms, disposal=1))
+
+    def close(self):
+        """写出尚在压缩的帧和 GIF 结束符"""
+        while self._pending:
+            self.fp.write(self._pending.popleft().result())
+        self.fp.write(b";")
+
+    def abort(self):
+        """放弃写出（如任务被取消），丢弃尚未开始的压缩任务"""
+        while self._pending:
+            self._pending.popleft().cancel()
+
+
+class PillowAnimationWriter:
+    """通过 Pillow 的 save(save_all=True) 写出 WebP/APNG 动图
+
+    Pillow 的 WebP/APNG 编码器需要一次拿到全部帧，因此 L 模式帧以双色调色板图片的形式暂存，
+    RGB（彩色）帧原样暂存，编码器自行计算相邻帧的变化区域。
+    """
+
+    def __init__(self, fp: BinaryIO, pil_format: str, loop: int = 0):
+        self.fp = fp
+        self.pil_format = pil_format
+        self.loop = loop
+        self._frames: List[PILImage.Image] = []
+        self._durations: List[int] = []
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._frames)
+
+    def write(self, frame: PILImage.Image, duration_ms: int):
+        """写入一帧 L 模式（双色）或 RGB 模式（彩色）图片"""
+        self._frames.append(_binarize_frame(frame) if frame.mode == "L" else frame)
+        self._durations.append(duration_ms)
+
+    def abort(self):
+        """放弃写出，释放暂存的帧"""
+        self._frames.clear()
+
+    def close(self):
+        """编码并写出全部帧"""
+        if not self._frames:
+            return
+        params: Dict[str, Any] = {"lossless": True} if self.pil_format == "WEBP" else {"optimize": True}
+        self._frames[0].save(
+            self.fp,
+            format=self.pil_format,
+            save_all=True,
+            append_images=self._frames[1:],
+            duration=self._durations,
+            loop=self.loop,
+            **params,
+        )
+        self._frames.clear()
+
+
+def _open_animation_writer(fmt: str, fp: BinaryIO, executor: Optional[ThreadPoolExecutor] = None, window: int = 0):
+    """按输出格式创建动图编码器，GIF 为流式编码（可将各帧压缩分发到 executor）
+
+    WebP/APNG 由 Pillow 在 close() 时一次编码全部帧，无法并行。
+    """
+    pil_format, _ = ANIMATED_OUTPUT_FORMATS[fmt]
+    if pil_format == "GIF":
+        return GifStreamWriter(fp, executor=executor, window=window)
+    return PillowAnimationWriter(fp, pil_format)
+
+
+class GlyphAtlas(NamedTuple):
+    """预渲染的等宽字形图集"""
+    glyphs: np.ndarray  # (字形数, 单元高, 单元宽) 的 uint8 数组
+    cell_w: int
+    cell_h: int
+
+
+@lru_cache(maxsize=8)
+def _load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """加载并缓存 TrueType 字体"""
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=8)
+def get_glyph_atlas(font_path: str, font_size: int) -> GlyphAtlas:
+    """按字体路径和字号缓存字形图集，每个字形只光栅化一次
+
+    单元宽取字体的字符步进，单元高取 Pillow 多行文本的行距，
+    因此按单元拼接的结果与 draw.text 绘制整段文本一致。
+    """
+    font = _load_font(font_path, font_size)
+    draw = ImageDraw.Draw(PILImage.new("L", (1, 1)))
+    cell_w = max(1, round(font.getlength("M")))
+    cell_h = max(1, draw.textbbox((0, 0), "A\nA", font=font)[3] - draw.textbbox((0, 0), "A", font=font)[3])
+
+    glyphs = np.empty((len(ATLAS_CHARS), cell_h, cell_w), dtype=np.uint8)
+    for idx, ch in enumerate(ATLAS_CHARS):
+        cell = PILImage.new("L", (cell_w, cell_h), 255)
+        ImageDraw.Draw(cell).text((0, 0), ch, fill=0, font=font)
+        glyphs[idx] = np.asarray(cell)
+    return GlyphAtlas(glyphs, cell_w, cell_h)
+
+
+def _render_with_atlas(text: str, atlas: GlyphAtlas) -> Optional[PILImage.Image]:
+    """按字符网格从图集拼接出图片；文本含非 ASCII 字符时返回 None"""
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    if not lines:
+        return None
+    cols = max(len(line) for line in lines)
+    if cols == 0:
+        return None
+    try:
+        data = "".join(line.ljust(cols) for line in lines).encode("ascii")
+    except UnicodeEncodeError:
+        return None
+
+    rows = len(lines)
+    grid = np.frombuffer(data.translate(ATLAS_INDEX_LUT), dtype=np.uint8).reshape(rows, cols)
+    # (行, 列, 单元高, 单元宽) -> (行 * 单元高, 列 * 单元宽)
+    tiles = atlas.glyphs[grid].transpose(0, 2, 1, 3).reshape(rows * atlas.cell_h, cols * atlas.cell_w)
+    return PILImage.fromarray(tiles)
+
+
+class ColorGrid(NamedTuple):
+    """彩色字符网格：每个单元的字形（图集下标）和源区域的平均颜色"""
+    glyphs: np.ndarray  # (行, 列) 的 uint8 图集下标
+    colors: np.ndarray  # (行, 列, 3) 的 uint8 RGB
+
+
+# 一帧的字符内容：灰度模式为字符文本，彩色模式为 ColorGrid
+FrameCells = Union[str, ColorGrid]
+
+
+def _color_grid(small: PILImage.Image) -> ColorGrid:
+    """由缩小到字符网格尺寸的 RGB 图片得到彩色字符网格
+
+    每个像素即一个字符单元，其颜色就是该单元源区域的平均颜色（由盒式缩小得到）；
+    字形按灰度经 CHAR_LUT 和 ATLAS_INDEX_LUT 两次查表得到，与灰度模式使用同一映射。
+    """
+    gray = small.convert("L").tobytes().translate(CHAR_LUT).translate(ATLAS_INDEX_LUT)
+    glyphs = np.frombuffer(gray, dtype=np.uint8).reshape(small.height, small.width)
+    return ColorGrid(glyphs, np.asarray(small, dtype=np.uint8))
+
+
+def _same_cells(a: Optional[FrameCells], b: Optional[FrameCells]) -> bool:
+    """判断两帧的字符内容是否完全相同"""
+    if isinstance(a, ColorGrid) and isinstance(b, ColorGrid):
+        return np.array_equal(a.glyphs, b.glyphs) and np.array_equal(a.colors, b.colors)
+    return a == b
+
+
+def _render_color_grid(grid: ColorGrid, atlas: GlyphAtlas) -> PILImage.Image:
+    """按字符网格从图集拼接字形，并以字形覆盖率在白色背景上混合单元颜色，返回 RGB 图片
+
+    单元颜色图按单元尺寸最近邻放大后，以字形覆盖率（255 - 字形灰度）为蒙版与白色背景合成，
+    即 out = 255 - 覆盖率 * (255 - 颜色)；全部为整幅图的批量运算，不逐单元循环。
+    """
+    rows, cols = grid.glyphs.shape
+    # (行, 列, 单元高, 单元宽) -> (行 * 单元高, 列 * 单元宽)
+    tiles = atlas.glyphs[grid.glyphs].transpose(0, 2, 1, 3).reshape(rows * atlas.cell_h, cols * atlas.cell_w)
+    coverage = PILImage.fromarray(255 - tiles)
+    colors = PILImage.fromarray(grid.colors).resize(coverage.size, PILImage.Resampling.NEAREST)
+    return PILImage.composite(colors, PILImage.new("RGB", coverage.size, "white"), coverage)
+
+
+# 支持的动图格式
+ANIMATED_FORMATS = {'GIF', 'PNG', 'APNG', 'WEBP', 'MNG'}
+
+# 文件魔术字节（用于格式检测）
+MAGIC_BYTES = {
+    'GIF': b'GIF8',
+    'PNG': b'\x89PNG\r\n\x1a\n',
+    'WEBP': b'RIFF',
+    'MNG': b'\x8aMNG\r\n\x1a\n'
+}
+
+
+# 下载结果：网络图片为 bytes，本地图片为只读 mmap（避免整文件复制）
+ImageData = Union[bytes, mmap.mmap]
+
+
+class ImageRejected(Exception):
+    """输入图片超出大小/尺寸/帧数限制"""
+
+
+def open_image(data: ImageData) -> PILImage.Image:
+    """惰性打开图片（只解析文件头，不解码像素）"""
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return PILImage.open(data)
+    return PILImage.open(io.BytesIO(data))
+
+
+class StageTimer:
+    """记录单个请求各处理阶段的累计耗时，可被多个线程同时写入"""
+
+    def __init__(self):
+        self.kind = "unknown"
+        self.fmt = "unknown"
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        """返回各阶段耗时的副本；超时后仍在运行的线程可能继续写入 stages"""
+        with self._lock:
+            return dict(self.stages)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+# 当前请求的阶段计时器；提交到线程池的任务会复制该上下文
+current_timer: contextvars.ContextVar[Optional[StageTimer]] = contextvars.ContextVar("charpic_timer", default=None)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """在当前请求的计时器中记录一个阶段，没有计时器时不做任何事"""
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(stage):
+        yield
+
+
+# ISO BMFF（ftyp）容器中属于静态图片格式的品牌
+IMAGE_FTYP_BRANDS = {b"heic", b"heix", b"hevc", b"heim", b"heis", b"mif1", b"msf1", b"avif", b"avis"}
+
+
+# 识别视频容器所需的文件头字节数
+VIDEO_HEADER_BYTES = 12
+# 分块计算文件哈希时每次读取的字节数
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class VideoFile(NamedTuple):
+    """已落盘的视频输入：本地文件，或下载时边接收边写入临时目录的文件
+
+    ffmpeg 直接读取 path，视频内容不载入内存；digest 为内容的 SHA-256，与按字节生成的缓存键一致。
+    temporary 为 True 时文件位于临时目录，由持有者在用完后删除。
+    """
+    path: str
+    ext: str
+    size: int
+    digest: str
+    temporary: bool = False
+
+
+# 转换输入：内存中的图片/视频字节、本地文件的 mmap，或已落盘的视频
+SourceData = Union[ImageData, VideoFile]
+
+
+def detect_video(data: SourceData) -> Optional[str]:
+    """根据文件头识别视频容器，返回扩展名（mp4/webm）或 None"""
+    if isinstance(data, VideoFile):
+        return data.ext
+    head = bytes(data[:VIDEO_HEADER_BYTES])
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if head[4:8] == b"ftyp" and head[8:12] not in IMAGE_FTYP_BRANDS:
+        return "mp4"
+    return None
+
+
+def open_video_file(path: str) -> Optional[VideoFile]:
+    """文件头为视频容器时返回对应的 VideoFile（分块计算内容哈希，不整体读入内存），否则返回 None"""
+    with open(path, "rb") as f:
+        ext = detect_video(f.read(VIDEO_HEADER_BYTES))
+        if ext is None:
+            return None
+        f.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return VideoFile(path, ext, size, digest.hexdigest())
+
+
+def _iter_video_frames(
+    path: str, fps: float, max_seconds: float, max_frames: int, stats: Dict[str, int]
+) -> Iterator[Tuple[PILImage.Image, int]]:
+    """通过 ffmpeg 流式解码视频，按 fps 抽样并缩小到 VIDEO_DECODE_WIDTH 宽，产出 (RGB 帧, 延迟毫秒)
+
+    ffmpeg 在子进程中解码，每次只读取一帧原始像素；时长和帧数上限由 ffmpeg 直接截断，
+    内存占用与视频长度无关。生成器关闭时 ffmpeg 进程随之结束。
+    """
+    reader = imageio_ffmpeg.read_frames(
+        path,
+        pix_fmt="rgb24",
+        output_params=[
+            "-vf", f"fps={fps:g},scale='min({VIDEO_DECODE_WIDTH},iw)':-2",
+            "-t", f"{max_seconds:g}",
+            "-frames:v", str(max_frames),
+        ],
+    )
+    try:
+        with timed_stage("decode"):
+            meta = next(reader)
+        size = meta["size"]
+        logger.info(
+            f"视频信息：编码 {meta.get('codec')}，原始尺寸 {meta.get('source_size')}，"
+            f"时长 {meta.get('duration')}s，抽样尺寸 {size[0]}x{size[1]}"
+        )
+        duration_ms = max(1, round(1000 / fps))
+        while True:
+            with timed_stage("decode"):
+                raw = next(reader, None)
+            if raw is None:
+                return
+            stats["source_frames"] = stats.get("source_frames", 0) + 1
+            yield PILImage.frombytes("RGB", size, raw), duration_ms
+    finally:
+        reader.close()
+
+
+class ResultCache:
+    """按内容寻址的字符画结果缓存
+
+    键为源图片字节哈希与渲染参数哈希的组合，值为最终输出字节及扩展名。
+    内存层为按字节预算淘汰的 LRU；可选的磁盘层按总大小淘汰最久未使用的文件。
+    """
+
+    def __init__(self, memory_budget: int, disk_dir: Optional[str] = None, disk_budget: int = 0):
+        self.memory_budget = max(0, memory_budget)
+        self.disk_budget = max(0, disk_budget)
+        self.disk_dir = Path(disk_dir) if disk_dir and self.disk_budget > 0 else None
+        self._memory: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, Tuple[Path, int]]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if self.disk_dir:
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(source: SourceData, params: str) -> str:
+        """由源图片字节（已落盘的视频使用其内容哈希）和渲染参数生成缓存键"""
+        source_hash = source.digest if isinstance(source, VideoFile) else hashlib.sha256(source).hexdigest()
+        params_hash = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+        return f"{source_hash}-{params_hash}"
+
+    def _load_disk_index(self):
+        """扫描磁盘缓存目录，按修改时间重建 LRU 顺序"""
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            entries = sorted(
+                (entry for entry in self.disk_dir.iterdir() if entry.is_file() and not entry.name.startswith(".")),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+        except OSError as e:
+            logger.warning(f"磁盘缓存目录不可用，已禁用磁盘缓存: {e}")
+            self.disk_dir = None
+            return
+        for entry in entries:
+            size = entry.stat().st_size
+            self._disk[entry.name.split(".", 1)[0]] = (entry, size)
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def contains(self, key: str) -> bool:
+        """缓存中是否已有该键（不读取内容，也不计入命中统计）"""
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """查询缓存，命中磁盘层时提升到内存层"""
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return item
+            disk_item = self._disk.get(key)
+
+        if disk_item is not None:
+            path, _ = disk_item
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except OSError:
+                data = None
+            if data is not None:
+                item = (data, path.suffix.lstrip("."))
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._put_memory(key, item)
+                return item
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes, file_ext: str):
+        """写入缓存（内存层，以及启用时的磁盘层）"""
+        item = (data, file_ext)
+        with self._lock:
+            self._put_memory(key, item)
+        if self.disk_dir is None or len(data) > self.disk_budget:
+            return
+        path = self.disk_dir / f"{key}.{file_ext}"
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败: {e}")
+            return
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old[1]
+            self._disk[key] = (path, len(data))
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key: str, item: Tuple[bytes, str]):
+        size = len(item[0])
+        if size > self.memory_budget:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._memory[key] = item
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_budget:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_budget and self._disk:
+            _, (path, size) = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中/未命中/淘汰计数及当前占用"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+class ScratchDir:
+    """按内容寻址的临时文件目录，供只能以文件发送图片的平台和需要从文件读取的视频解码使用
+
+    目录优先位于 /dev/shm（内存文件系统），按进程区分；相同内容的结果复用同一文件，
+    引用计数归零时删除文件，插件停止时删除整个目录。创建时顺带清理已退出进程遗留的目录。
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        if root is None:
+            root = next((r for r in SCRATCH_ROOTS if os.path.isdir(r) and os.access(r, os.W_OK)), tempfile.gettempdir())
+        self.root = root
+        self.path = os.path.join(root, f"{SCRATCH_PREFIX}{os.getpid()}")
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sweep_stale(self):
+        """删除已退出进程遗留的临时目录"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            pid = name[len(SCRATCH_PREFIX):]
+            if not name.startswith(SCRATCH_PREFIX) or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            except OSError:
+                pass
+
+    def _ensure_dir(self):
+        """首次使用时创建临时目录（需持有 _lock）"""
+        if not os.path.isdir(self.path):
+            self._sweep_stale()
+            os.makedirs(self.path, exist_ok=True)
+
+    def create(self, ext: str) -> Tuple[BinaryIO, str]:
+        """新建一个独占的临时文件（不按内容寻址），返回 (可写文件对象, 路径)，由调用方负责删除"""
+        with self._lock:
+            self._ensure_dir()
+        fd, path = tempfile.mkstemp(suffix=f".{ext}", dir=self.path)
+        return os.fdopen(fd, "wb"), path
+
+    @contextmanager
+    def file(self, data: bytes, ext: str) -> Iterator[str]:
+        """将 data 写入（或复用）临时文件并返回路径，退出时释放引用"""
+        name = f"{hashlib.blake2b(data, digest_size=16).hexdigest()}.{ext}"
+        path = os.path.join(self.path, name)
+        with self._lock:
+            self._ensure_dir()
+            if self._refs.get(name, 0) == 0:
+                # 写入临时名后原子替换，其他请求不会读到写了一半的文件
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._refs[name] = self._refs.get(name, 0) + 1
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._refs[name] -= 1
+                if self._refs[name] == 0:
+                    del self._refs[name]
+                    try:
+                        os.unlink(path)
+                    except OSError as e:
+                        logger.warning(f"删除临时文件失败: {e}")
+
+    def cleanup(self):
+        """删除整个临时目录"""
+        with self._lock:
+            self._refs.clear()
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _render_params(policy: AnimationPolicy, animated_format: str, options: OutputOptions = IMAGE_OUTPUT) -> str:
+    """影响输出结果的全部渲染参数，用于构造缓存键"""
+    return "|".join([
+        f"output={options.mode}:{options.char_width}",
+        f"policy={tuple(policy)}",
+        f"static_w={STATIC_CHAR_WIDTH}",
+        f"animated_w={ANIMATED_CHAR_WIDTH}",
+        f"font={DEFAULT_FONT_PATH.name}",
+        f"size={FONT_SIZE}",
+        f"aspect={FONT_ASPECT_RATIO}",
+        f"map={STR_MAP}",
+        "static=png",
+        f"animated={animated_format}",
+    ])
+
+
+def parse_output_options(args: List[str]) -> OutputOptions:
+    """解析输出形式参数：`color`、`text [宽度]` 或 `rle [宽度]`，其他情况输出灰度图片"""
+    if not args or args[0].lower() not in OUTPUT_MODE_ALIASES:
+        return IMAGE_OUTPUT
+    if OUTPUT_MODE_ALIASES[args[0].lower()] == "color":
+        return OutputOptions("color")
+    char_width = DEFAULT_TEXT_CHAR_WIDTH
+    if len(args) > 1 and args[1].isdigit():
+        char_width = min(max(int(args[1]), MIN_TEXT_CHAR_WIDTH), STATIC_CHAR_WIDTH)
+    return OutputOptions(OUTPUT_MODE_ALIASES[args[0].lower()], char_width)
+
+
+def detect_format_from_bytes(img_bytes: bytes) -> Optional[str]:
+    """根据文件头（魔术字节）检测图片格式"""
+    try:
+        if img_bytes.startswith(MAGIC_BYTES['GIF']):
+            return 'GIF'
+        elif img_bytes.startswith(MAGIC_BYTES['PNG']):
+            return 'PNG'
+        elif img_bytes.startswith(MAGIC_BYTES['MNG']):
+            return 'MNG'
+        elif img_bytes.startswith(MAGIC_BYTES['WEBP']):
+            if b'WEBP' in img_bytes[:20]:
+                return 'WEBP'
+        return None
+    except Exception as e:
+        logger.error(f"检测图片格式时出错: {e}")
+        return None
+
+
+class CharPicEngine:
+    """字符画转换引擎
+
+    所有转换方法均为同步方法，在调用线程中完成（动图帧可分发到引擎自己的帧线程池），
+    可由插件的转换线程池、命令行的进程池或基准脚本直接调用。
+    """
+
+    def __init__(
+        self,
+        animated_format: str = DEFAULT_ANIMATED_FORMAT,
+        animation_policy: Optional[AnimationPolicy] = None,
+        frame_workers: int = DEFAULT_FRAME_WORKERS,
+        video_fps: float = DEFAULT_VIDEO_FPS,
+        max_video_seconds: float = DEFAULT_MAX_VIDEO_SECONDS,
+        scratch: Optional["ScratchDir"] = None,
+    ):
+        self.animation_policy = animation_policy or AnimationPolicy(
+            budget_mpx=DEFAULT_ANIMATION_BUDGET_MPX,
+            max_output_frames=DEFAULT_MAX_OUTPUT_FRAMES,
+            max_stride=DEFAULT_MAX_FRAME_STRIDE,
+            min_char_width=DEFAULT_MIN_CHAR_WIDTH,
+        )
+        self.animated_format = animated_format.lower()
+        if self.animated_format not in ANIMATED_OUTPUT_FORMATS:
+            logger.warning(f"不支持的动图输出格式 {self.animated_format}，使用 {DEFAULT_ANIMATED_FORMAT}")
+            self.animated_format = DEFAULT_ANIMATED_FORMAT
+        self.frame_window = max(1, frame_workers) * FRAME_WINDOW_PER_WORKER
+        self.frame_executor = (
+            ThreadPoolExecutor(max_workers=frame_workers, thread_name_prefix="charpic-frame")
+            if frame_workers > 1 else None
+        )
+        self.video_fps = max(0.1, float(video_fps))
+        self.max_video_seconds = max(0.1, float(max_video_seconds))
+        self.scratch = scratch or ScratchDir()
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], scratch: Optional["ScratchDir"] = None) -> "CharPicEngine":
+        """按插件配置（键名见 _conf_schema.json）创建引擎，缺省项使用默认值"""
+        return cls(
+            animated_format=str(config.get("animated_format", DEFAULT_ANIMATED_FORMAT)),
+            animation_policy=AnimationPolicy(
+                budget_mpx=float(config.get("animation_budget_mpx", DEFAULT_ANIMATION_BUDGET_MPX)),
+                max_output_frames=int(config.get("max_output_frames", DEFAULT_MAX_OUTPUT_FRAMES)),
+                max_stride=int(config.get("max_frame_stride", DEFAULT_MAX_FRAME_STRIDE)),
+                min_char_width=int(config.get("min_char_width", DEFAULT_MIN_CHAR_WIDTH)),
+            ),
+            frame_workers=int(config.get("frame_workers", DEFAULT_FRAME_WORKERS)),
+            video_fps=float(config.get("video_fps", DEFAULT_VIDEO_FPS)),
+            max_video_seconds=float(config.get("max_video_seconds", DEFAULT_MAX_VIDEO_SECONDS)),
+            scratch=scratch,
+        )
+
+    def close(self):
+        """关闭帧线程池；临时目录由创建者负责清理"""
+        if self.frame_executor is not None:
+            self.frame_executor.shutdown(wait=False, cancel_futures=True)
+
+    def convert(
+        self, data: SourceData, options: OutputOptions = IMAGE_OUTPUT, cancel_event: Optional[threading.Event] = None
+    ) -> Tuple[Optional[bytes], str]:
+        """按文件头区分图片和视频并转换，返回 (结果字节, 文件扩展名)"""
+        if detect_video(data):
+            return self.convert_video(data, options, cancel_event)
+        return self.convert_image(open_image(data), options, cancel_event)
+
+    def estimate_cost(self, img: PILImage.Image, options: OutputOptions = IMAGE_OUTPUT) -> float:
+        """根据文件头估算转换工作量（百万像素），与动图预算使用同一成本模型"""
+        if options.mode in TEXT_OUTPUT_EXTS:
+            # 文本模式只解码第一帧，不渲染
+            return img.width * img.height / 1_000_000
+        cell_size = self._cell_size()
+        if self._is_animated(img):
+            frame_count = self._get_frame_count(img)
+            plan = _plan_animation(self.animation_policy, frame_count, img.size, cell_size)
+            if plan is None:
+                # 超出预算的动图在开始处理时即被拒绝，不产生实际工作量
+                return 0.0
+            stride, char_width = plan
+            return _animation_cost(frame_count, img.size, cell_size, stride, char_width) / 1_000_000
+
+        cols, rows = _char_grid_size(img.width, img.height, STATIC_CHAR_WIDTH, False)
+        return (img.width * img.height + cols * cell_size[0] * rows * cell_size[1]) / 1_000_000
+
+    def estimate_video_cost(self, options: OutputOptions = IMAGE_OUTPUT) -> float:
+        """按抽样帧率、时长上限和解码后的帧尺寸估算视频转换工作量（百万像素）
+
+        准入时尚未解码，帧尺寸取竖屏视频的最坏情况 VIDEO_ESTIMATE_FRAME_SIZE；
+        ffmpeg 在子进程中的全分辨率解码不计入。
+        """
+        frame_size = VIDEO_ESTIMATE_FRAME_SIZE
+        if options.mode in TEXT_OUTPUT_EXTS:
+            return frame_size[0] * frame_size[1] / 1_000_000
+        frames = min(math.ceil(self.video_fps * self.max_video_seconds), self.animation_policy.max_output_frames)
+        return _animation_cost(frames, frame_size, self._cell_size(), 1, ANIMATED_CHAR_WIDTH) / 1_000_000
+
+    def cache_params(self, options: OutputOptions = IMAGE_OUTPUT) -> str:
+        """当前配置下影响输出结果的全部参数"""
+        params = _render_params(self.animation_policy, self.animated_format, options)
+        return f"{params}|video={self.video_fps:g}:{self.max_video_seconds:g}"
+
+    def _is_animated(self, img: PILImage.Image) -> bool:
+        """检测图片是否为动图"""
+        try:
+            if img.format == 'GIF':
+                try:
+                    img.seek(1)
+                    img.seek(0)
+                    return True
+                except EOFError:
+                    return False
+            
+            if img.format in ('PNG', 'APNG'):
+                if hasattr(img, 'n_frames') and img.n_frames > 1:
+                    return True
+                try:
+                    img.seek(1)
+                    img.seek(0)
+                    return True
+                except (EOFError, AttributeError):
+                    return False
+            
+            if img.format == 'WEBP':
+                if hasattr(img, 'n_frames') and img.n_frames > 1:
+                    return True
+                try:
+                    img.seek(1)
+                    img.seek(0)
+                    return True
+                except EOFError:
+                    return False
+            
+            return False
+        except Exception as e:
+            logger.warning(f"检测动图时出错: {e}")
+            return False
+
+    def _get_frame_count(self, img: PILImage.Image) -> int:
+        """获取图片的帧数"""
+        try:
+            if hasattr(img, 'n_frames'):
+                return img.n_frames
+            
+            frame_count = 0
+            try:
+                while True:
+                    img.seek(frame_count)
+                    frame_count += 1
+            except EOFError:
+                pass
+            
+            img.seek(0)
+            return frame_count
+        except Exception as e:
+            logger.error(f"获取帧数时出错: {e}")
+            return 0
+
+    def convert_image(
+        self, img: PILImage.Image, options: OutputOptions = IMAGE_OUTPUT, cancel_event: Optional[threading.Event] = None
+    ) -> Tuple[Optional[bytes], str]:
+        """同步转换入口（在线程池中运行），返回 (结果字节, 文件扩展名)"""
+        timer = current_timer.get()
+        if options.mode in TEXT_OUTPUT_EXTS:
+            if timer is not None:
+                timer.kind = options.mode
+                timer.fmt = img.format or "unknown"
+            return self._process_text_output(img, options), TEXT_OUTPUT_EXTS[options.mode]
+        is_animated = self._is_animated(img)
+        color = options.mode == "color" and self._color_available()
+        if timer is not None:
+            timer.kind = ("animated" if is_animated else "static") + ("_color" if color else "")
+            timer.fmt = img.format or "unknown"
+        if is_animated:
+            frame_count = self._get_frame_count(img)
+            logger.info(f"检测到动图，格式: {img.format}, 帧数: {frame_count}")
+            return (
+                self._process_animated_image(img, cancel_event, color),
+                ANIMATED_OUTPUT_FORMATS[self.animated_format][1],
+            )
+
+        logger.info(f"开始处理静态图片，格式: {img.format}")
+        return self._process_static_image(img, color), "png"
+
+    def convert_video(
+        self, data: SourceData, options: OutputOptions = IMAGE_OUTPUT, cancel_event: Optional[threading.Event] = None
+    ) -> Tuple[Optional[bytes], str]:
+        """视频转换入口（在线程池中运行）：流式解码并按帧率抽样后走动图流程，返回 (结果字节, 文件扩展名)
+
+        data 为 VideoFile 时 ffmpeg 直接读取该文件，不经过内存。
+        文本模式只取第一帧。抽样帧数超出动图预算时同样按抽帧间隔和字符宽度降级。
+        """
+        if imageio_ffmpeg is None:
+            raise ImageRejected("未安装 imageio-ffmpeg，不支持视频输入")
+        video_ext = detect_video(data) or "mp4"
+        text_mode = options.mode in TEXT_OUTPUT_EXTS
+        file_ext = TEXT_OUTPUT_EXTS[options.mode] if text_mode else ANIMATED_OUTPUT_FORMATS[self.animated_format][1]
+        color = options.mode == "color" and self._color_available()
+        timer = current_timer.get()
+        if timer is not None:
+            timer.kind = options.mode if text_mode else "video" + ("_color" if color else "")
+            timer.fmt = video_ext.upper()
+
+        max_frames = 1 if text_mode else min(
+            math.ceil(self.video_fps * self.max_video_seconds), self.animation_policy.max_output_frames
+        )
+        try:
+            # ffmpeg 需要从文件读取：已落盘的视频直接使用原路径，内存中的视频先写入临时目录（优先内存文件系统）
+            source = nullcontext(data.path) if isinstance(data, VideoFile) else self.scratch.file(data, video_ext)
+            with source as path:
+                frame_stats: Dict[str, int] = {"source_frames": 0, "skipped_frames": 0}
+                frames = _iter_video_frames(path, self.video_fps, self.max_video_seconds, max_frames, frame_stats)
+                with closing(frames):
+                    first = next(frames, None)
+                    if first is None:
+                        logger.error("视频中没有可解码的帧")
+                        return None, file_ext
+                    if text_mode:
+                        return self._process_text_output(first[0], options), file_ext
+
+                    plan = _plan_animation(self.animation_policy, max_frames, first[0].size, self._cell_size())
+                    if plan is None:
+                        raise ImageRejected(f"视频超出 {self.animation_policy.budget_mpx:g} 百万像素的处理预算")
+                    stride, char_width = plan
+
+                    def sampled() -> Iterator[Tuple[Optional[PILImage.Image], int]]:
+                        for index, (frame, duration_ms) in enumerate(chain([first], frames)):
+                            if index % stride:
+                                frame_stats["skipped_frames"] += 1
+                                yield None, duration_ms
+                            else:
+                                yield frame, duration_ms
+
+                    cols, rows = _char_grid_size(first[0].width, first[0].height, char_width, True)
+                    merged = self._iter_merged_frames(sampled(), frame_stats, char_width, color)
+                    result_bytes = self._write_animation(
+                        merged, self._canvas_size(cols, rows), f"视频({video_ext})", frame_stats, stride, cancel_event
+                    )
+                    return result_bytes, file_ext
+        except ImageRejected:
+            raise
+        except Exception as e:
+            logger.error(f"处理视频时出错: {e}")
+            return None, file_ext
+
+    def _get_pic_text(self, img: PILImage.Image, new_w: int = STATIC_CHAR_WIDTH, enforce_target_width: bool = False) -> str:
+        """将图片转换为字符文本"""
+        try:
+            w, h = img.size
+
+            if w == 0 or h == 0:
+                logger.warning("输入图片尺寸非法，无法转换为字符文本")
+                return ""
+
+            target_w, target_h = _char_grid_size(w, h, new_w, enforce_target_width)
+            img = _decode_for_grid(img, target_w, target_h)
+            if img.size != (target_w, target_h):
+                with timed_stage("gray_resize"):
+                    img = img.resize((target_w, target_h))
+
+            with timed_stage("char_map"):
+                return _gray_to_text(img)
+        except Exception as e:
+            logger.error(f"转换图片为字符文本时出错: {e}")
+            return ""
+
+    def _get_color_grid(
+        self, img: PILImage.Image, new_w: int = STATIC_CHAR_WIDTH, enforce_target_width: bool = False
+    ) -> Optional[ColorGrid]:
+        """将图片转换为彩色字符网格（字形 + 单元平均颜色）"""
+        try:
+            w, h = img.size
+
+            if w == 0 or h == 0:
+                logger.warning("输入图片尺寸非法，无法转换为彩色字符网格")
+                return None
+
+            target_w, target_h = _char_grid_size(w, h, new_w, enforce_target_width)
+            img = _decode_for_grid(img, target_w, target_h, mode="RGB")
+            if img.size != (target_w, target_h):
+                with timed_stage("gray_resize"):
+                    # 盒式缩小使每个单元的颜色为其源区域的平均颜色
+                    img = img.resize((target_w, target_h), PILImage.Resampling.BOX)
+
+            with timed_stage("char_map"):
+                return _color_grid(img)
+        except Exception as e:
+            logger.error(f"转换图片为彩色字符网格时出错: {e}")
+            return None
+
+    @staticmethod
+    def _color_available() -> bool:
+        """彩色模式依赖字形图集，缺少字体文件时退回灰度输出"""
+        if DEFAULT_FONT_PATH.exists():
+            return True
+        logger.warning(f"字体文件不存在: {DEFAULT_FONT_PATH}，彩色模式改为灰度输出")
+        return False
+
+    def _get_text_dimensions(self, font_path: str, font_size: int, text: str) -> tuple[ImageFont.FreeTypeFont, int, int]:
+        """获取文本的尺寸"""
+        try:
+            font = _load_font(font_path, font_size)
+            
+            # 创建一个临时图片用于计算文本尺寸
+            temp_img = PILImage.new("L", (1, 1))
+            draw = ImageDraw.Draw(temp_img)
+            
+            try:
+                # 旧版本PIL
+                w, h = draw.textsize(text, font=font)
+            except AttributeError:
+                # 新版本PIL (>=10.0)
+                bbox = draw.textbbox((0, 0), text, font=font)
+                w = bbox[2] - bbox[0]
+                h = bbox[3] - bbox[1]
+            
+            return font, w, h
+        except Exception as e:
+            logger.error(f"获取文本尺寸时出错: {e}")
+            # 使用默认字体
+            font = ImageFont.load_default()
+            # 简单估算尺寸
+            lines = text.split('\n')
+            max_width = max(len(line) for line in lines) * 8
+            height = len(lines) * 10
+            return font, max_width, height
+
+    def _text_to_image(self, text: str) -> PILImage.Image:
+        """将文本转换为图片"""
+        try:
+            if not text:
+                return PILImage.new("L", (1, 1), "#FFFFFF")
+            
+            font_path = str(DEFAULT_FONT_PATH)
+            if not Path(font_path).exists():
+                logger.warning(f"字体文件不存在: {font_path}，使用默认字体")
+                font = ImageFont.load_default()
+                # 简单估算尺寸
+                lines = text.split('\n')
+                max_width = max(len(line) for line in lines) * 10
+                height = len(lines) * 12
+                img = PILImage.new("L", (max_width, height), "#FFFFFF")
+                draw = ImageDraw.Draw(img)
+                draw.text((0, 0), text, fill="#000000", font=font)
+                return img
+            
+            img = _render_with_atlas(text, get_glyph_atlas(font_path, FONT_SIZE))
+            if img is not None:
+                return img
+
+            font, w, h = self._get_text_dimensions(font_path, FONT_SIZE, text)
+            img = PILImage.new("L", (w, h), "#FFFFFF")
+            draw = ImageDraw.Draw(img)
+            draw.text((0, 0), text, fill="#000000", font=font)
+            return img
+        except Exception as e:
+            logger.error(f"将文本转换为图片时出错: {e}")
+            # 返回一个简单的错误图片
+            return PILImage.new("L", (100, 50), "#FFFFFF")
+
+    def _process_static_image(self, img: PILImage.Image, color: bool = False) -> Optional[bytes]:
+        """处理静态图片"""
+        try:
+            logger.info(f"开始处理静态图片，原始尺寸: {img.size}")
+
+            if color:
+                return self._render_color_png(self._get_color_grid(img))
+            
+            text = self._get_pic_text(img)
+            if not text:
+                logger.error("图片转换为字符文本失败")
+                return None
+            
+            logger.info(f"图片转换为字符文本成功，文本长度: {len(text)}")
+            
+            result_bytes = self.render_text_png(text)
+            if result_bytes:
+                logger.info(f"静态图片字符画生成成功，大小: {len(result_bytes)} bytes")
+            return result_bytes
+        except Exception as e:
+            logger.error(f"处理静态图片时出错: {e}")
+            return None
+
+    def render_text_png(self, text: str, cancel_event: Optional[threading.Event] = None) -> Optional[bytes]:
+        """将字符文本渲染并编码为 PNG"""
+        with timed_stage("render"):
+            result_img = self._text_to_image(text)
+        if not result_img:
+            logger.error("字符文本转换为图片失败")
+            return None
+
+        logger.info(f"字符文本转换为图片成功，结果尺寸: {result_img.size}")
+
+        output = io.BytesIO()
+        with timed_stage("encode"):
+            result_img.save(output, format="PNG")
+        return output.getvalue()
+
+    def _render_color_png(self, grid: Optional[ColorGrid]) -> Optional[bytes]:
+        """将彩色字符网格渲染并编码为 PNG"""
+        if grid is None:
+            logger.error("图片转换为彩色字符网格失败")
+            return None
+        with timed_stage("render"):
+            result_img = _render_color_grid(grid, get_glyph_atlas(str(DEFAULT_FONT_PATH), FONT_SIZE))
+        output = io.BytesIO()
+        with timed_stage("encode"):
+            # 量化为自适应调色板后编码，比真彩色 PNG 更快、体积约为其 1/8
+            result_img.quantize(COLOR_PALETTE_SIZE, method=PILImage.Quantize.FASTOCTREE).save(output, format="PNG")
+        result_bytes = output.getvalue()
+        logger.info(f"彩色字符画生成成功，尺寸: {result_img.size}，大小: {len(result_bytes)} bytes")
+        return result_bytes
+
+    def render_contact_sheet(
+        self, results: List[Tuple[bytes, str]], cancel_event: Optional[threading.Event] = None
+    ) -> Tuple[Optional[bytes], List[int]]:
+        """将多张静态字符画结果按网格拼成一张 PNG，返回 (拼图字节, 拼入的结果下标)
+
+        动图和文本结果不拼入；可拼入的结果少于两张时返回 (None, [])。
+        各结果保持原尺寸（缩小会使字符难以辨认），列宽与行高取该列/该行中最大的结果。
+        """
+        try:
+            tiles: List[PILImage.Image] = []
+            indexes: List[int] = []
+            for index, (data, file_ext) in enumerate(results):
+                if file_ext != "png":
+                    continue
+                with timed_stage("decode"):
+                    tile = PILImage.open(io.BytesIO(data))
+                    if getattr(tile, "n_frames", 1) > 1:
+                        continue
+                    tile.load()
+                tiles.append(tile)
+                indexes.append(index)
+            if len(tiles) < 2:
+                return None, []
+
+            with timed_stage("render"):
+                cols = math.ceil(math.sqrt(len(tiles)))
+                rows = math.ceil(len(tiles) / cols)
+                col_widths = [max(tile.width for tile in tiles[c::cols]) for c in range(cols)]
+                row_heights = [max(tile.height for tile in tiles[r * cols:(r + 1) * cols]) for r in range(rows)]
+                gray = all(tile.mode == "L" for tile in tiles)
+                sheet = PILImage.new(
+                    "L" if gray else "RGB",
+                    (sum(col_widths) + CONTACT_SHEET_GAP * (cols - 1), sum(row_heights) + CONTACT_SHEET_GAP * (rows - 1)),
+                    "white",
+                )
+                for i, tile in enumerate(tiles):
+                    r, c = divmod(i, cols)
+                    position = (sum(col_widths[:c]) + CONTACT_SHEET_GAP * c, sum(row_heights[:r]) + CONTACT_SHEET_GAP * r)
+                    sheet.paste(tile.convert(sheet.mode), position)
+
+            output = io.BytesIO()
+            with timed_stage("encode"):
+                if not gray:
+                    sheet = sheet.quantize(COLOR_PALETTE_SIZE, method=PILImage.Quantize.FASTOCTREE)
+                sheet.save(output, format="PNG")
+            result_bytes = output.getvalue()
+            logger.info(f"拼图生成成功，{len(tiles)} 张，{cols}x{rows} 网格，尺寸: {sheet.size}，大小: {len(result_bytes)} bytes")
+            return result_bytes, indexes
+        except Exception as e:
+            logger.error(f"生成拼图时出错: {e}")
+            return None, []
+
+    def _process_text_output(self, img: PILImage.Image, options: OutputOptions) -> Optional[bytes]:
+        """生成文本形式的字符画（动图取第一帧），不加载字体、不渲染也不编码图片"""
+        text = self._get_pic_text(img, options.char_width)
+        if not text:
+            logger.error("图片转换为字符文本失败")
+            return None
+        if options.mode == "rle":
+            with timed_stage("encode"):
+                text = _compress_runs(text)
+        return text.encode("utf-8")
+
+    def _cell_size(self) -> Tuple[int, int]:
+        """单个字符在渲染结果中的像素尺寸"""
+        if DEFAULT_FONT_PATH.exists():
+            atlas = get_glyph_atlas(str(DEFAULT_FONT_PATH), FONT_SIZE)
+            return atlas.cell_w, atlas.cell_h
+        # 与 _text_to_image 的默认字体估算一致
+        return 10, 12
+
+    def _canvas_size(self, cols: int, rows: int) -> Tuple[int, int]:
+        """由字符网格尺寸直接计算渲染结果的像素尺寸"""
+        cell_w, cell_h = self._cell_size()
+        if DEFAULT_FONT_PATH.exists():
+            return cols * cell_w, rows * cell_h
+        return cols * cell_w, (rows + 1) * cell_h
+
+    def _iter_source_frames(
+        self, img: PILImage.Image, stats: Dict[str, int], stride: int
+    ) -> Iterator[Tuple[Optional[PILImage.Image], int]]:
+        """按顺序解码合成各帧，产出 (RGBA 帧, 延迟毫秒)；被抽掉的帧产出 (None, 延迟毫秒)"""
+        frame_index = 0
+        while True:
+            try:
+                with timed_stage("decode"):
+                    img.seek(frame_index)
+            except EOFError:
+                return
+
+            duration_ms = img.info.get("duration", 80)
+            if not duration_ms or duration_ms <= 0:
+                duration_ms = 80
+
+            frame_index += 1
+            stats["source_frames"] = frame_index
+            if (frame_index - 1) % stride != 0:
+                stats["skipped_frames"] += 1
+                yield None, int(duration_ms)
+                continue
+
+            with timed_stage("decode"):
+                frame = img.convert("RGBA")
+            logger.debug(
+                f"第 {frame_index - 1} 帧：原始尺寸 {frame.width}x{frame.height}，延迟 {duration_ms}ms"
+            )
+            yield frame, int(duration_ms)
+
+    def _frame_cells(self, frame: PILImage.Image, char_width: int, color: bool) -> Optional[FrameCells]:
+        """单帧的字符映射：灰度模式为字符文本，彩色模式为彩色字符网格"""
+        if color:
+            return self._get_color_grid(frame, new_w=char_width, enforce_target_width=True)
+        return self._get_pic_text(frame, new_w=char_width, enforce_target_width=True)
+
+    def _convert_frame(
+        self, frame: PILImage.Image, char_width: int, color: bool = False
+    ) -> Tuple[Optional[FrameCells], PILImage.Image]:
+        """单帧的字符映射与渲染（并行模式下在帧线程中运行）"""
+        cells = self._frame_cells(frame, char_width, color)
+        return cells, self._render_frame(cells)
+
+    def _iter_frame_texts(
+        self, source: Iterator[Tuple[Optional[PILImage.Image], int]], char_width: int, color: bool = False
+    ) -> Iterator[Tuple[Optional[FrameCells], Optional[PILImage.Image], int]]:
+        """按源帧顺序产出 (字符内容, 已渲染帧, 延迟毫秒)
+
+        顺序模式下只做字符映射，渲染推迟到去重之后；
+        并行模式下解码合成仍按顺序进行，字符映射和渲染分发到帧线程池，
+        最多 frame_window 帧同时在途，结果按原顺序取回。
+        被抽掉的帧产出 (None, None, 延迟毫秒)。
+        """
+        if self.frame_executor is None:
+            for frame, duration_ms in source:
+                if frame is None:
+                    yield None, None, duration_ms
+                else:
+                    yield self._frame_cells(frame, char_width, color), None, duration_ms
+            return
+
+        window: "deque[Tuple[Optional[Future], int]]" = deque()
+        try:
+            for frame, duration_ms in source:
+                future = None if frame is None else self.frame_executor.submit(
+                    contextvars.copy_context().run, self._convert_frame, frame, char_width, color
+                )
+                window.append((future, duration_ms))
+                while len(window) > self.frame_window:
+                    yield self._take_frame_result(window.popleft())
+            while window:
+                yield self._take_frame_result(window.popleft())
+        finally:
+            # 提前结束（取消或出错）时丢弃尚未开始的帧任务
+            for future, _ in window:
+                if future is not None:
+                    future.cancel()
+
+    @staticmethod
+    def _take_frame_result(
+        item: Tuple[Optional[Future], int]
+    ) -> Tuple[Optional[FrameCells], Optional[PILImage.Image], int]:
+        future, duration_ms = item
+        if future is None:
+            return None, None, duration_ms
+        cells, frame_img = future.result()
+        return cells, frame_img, duration_ms
+
+    def _iter_animated_frames(
+        self,
+        img: PILImage.Image,
+        stats: Dict[str, int],
+        stride: int = 1,
+        char_width: int = ANIMATED_CHAR_WIDTH,
+        color: bool = False,
+    ) -> Iterator[Tuple[PILImage.Image, int]]:
+        """逐帧解码 -> 字符文本（彩色模式为彩色字符网格）-> 渲染，依次产出 (字符画帧, 延迟毫秒)
+
+        每 stride 帧只处理一帧，被抽掉的帧的延迟并入前一保留帧以保持播放速度。
+        字符内容与上一帧完全相同的帧不再输出，其延迟同样并入上一帧，
+        因此每帧需等到下一帧的字符内容确定后才产出。
+        stats 中记录源帧数 (source_frames)、被抽掉的帧数 (skipped_frames)
+        和被合并的重复帧数 (dropped_frames)。
+        """
+        stats["source_frames"] = 0
+        stats["skipped_frames"] = 0
+        return self._iter_merged_frames(self._iter_source_frames(img, stats, stride), stats, char_width, color)
+
+    def _iter_merged_frames(
+        self,
+        source: Iterator[Tuple[Optional[PILImage.Image], int]],
+        stats: Dict[str, int],
+        char_width: int,
+        color: bool = False,
+    ) -> Iterator[Tuple[PILImage.Image, int]]:
+        """将源帧转换为字符画帧并合并内容重复的相邻帧，依次产出 (字符画帧, 延迟毫秒)"""
+        stats["dropped_frames"] = 0
+        pending_text: Optional[FrameCells] = None
+        pending_img: Optional[PILImage.Image] = None
+        pending_duration = 0
+        for text, frame_img, duration_ms in self._iter_frame_texts(source, char_width, color):
+            if text is None:
+                pending_duration += duration_ms
+                continue
+            if not text:
+                logger.warning("存在字符画内容为空的帧")
+
+            if pending_text is not None and _same_cells(text, pending_text):
+                pending_duration += duration_ms
+                stats["dropped_frames"] += 1
+                continue
+
+            if pending_text is not None:
+                yield pending_img if pending_img is not None else self._render_frame(pending_text), pending_duration
+            pending_text, pending_img, pending_duration = text, frame_img, duration_ms
+
+        if pending_text is not None:
+            yield pending_img if pending_img is not None else self._render_frame(pending_text), pending_duration
+
+    def _render_frame(self, text: FrameCells) -> PILImage.Image:
+        """将一帧字符文本渲染为 L 模式图片，彩色字符网格渲染为 RGB 图片"""
+        with timed_stage("render"):
+            if isinstance(text, ColorGrid):
+                return _render_color_grid(text, get_glyph_atlas(str(DEFAULT_FONT_PATH), FONT_SIZE))
+            frame_img = self._text_to_image(text)
+            if frame_img.mode != "L":
+                frame_img = frame_img.convert("L")
+        return frame_img
+
+    def _process_animated_image(
+        self, img: PILImage.Image, cancel_event: Optional[threading.Event] = None, color: bool = False
+    ) -> Optional[bytes]:
+        """处理动图（GIF/APNG/WebP/MNG）
+
+        各帧以生成器方式逐帧产出并立即写入编码器，GIF 输出时内存占用与帧数无关。
+        字符画宽度固定，输出画布尺寸可由源图尺寸预先算出，无需二次填充。
+        color 为 True 时输出彩色字符画，GIF 使用由首帧生成的共享调色板。
+        """
+        try:
+            img_format = img.format or 'UNKNOWN'
+            logger.info(f"开始处理动图，格式: {img_format}")
+
+            try:
+                img.seek(0)
+            except EOFError:
+                logger.error(f"{img_format} 不包含有效帧")
+                return None
+
+            source_frames = self._get_frame_count(img)
+            plan = _plan_animation(self.animation_policy, source_frames, img.size, self._cell_size())
+            if plan is None:
+                raise ImageRejected(
+                    f"{source_frames} 帧 {img.width}x{img.height} 动图超出 {self.animation_policy.budget_mpx:g} 百万像素的处理预算"
+                )
+            stride, char_width = plan
+            if stride > 1 or char_width != ANIMATED_CHAR_WIDTH:
+                logger.info(f"动图超出工作量预算，抽帧间隔 {stride}，字符宽度 {char_width}")
+
+            cols, rows = _char_grid_size(img.width, img.height, char_width, True)
+            target_size = self._canvas_size(cols, rows)
+            if target_size[0] == 0 or target_size[1] == 0:
+                logger.error(f"字符画帧尺寸异常: {target_size}")
+                return None
+
+            frame_stats: Dict[str, int] = {}
+            frames = self._iter_animated_frames(img, frame_stats, stride, char_width, color)
+            return self._write_animation(frames, target_size, img_format, frame_stats, stride, cancel_event)
+        except ImageRejected:
+            raise
+        except Exception as e:
+            logger.error(f"处理动图时出错: {e}")
+            return None
+
+    def _write_animation(
+        self,
+        frames: Iterator[Tuple[PILImage.Image, int]],
+        target_size: Tuple[int, int],
+        img_format: str,
+        frame_stats: Dict[str, int],
+        stride: int,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Optional[bytes]:
+        """将字符画帧逐帧写入动图编码器（尺寸不一致的帧填充到 target_size），返回编码结果"""
+        output = io.BytesIO()
+        writer = _open_animation_writer(self.animated_format, output, self.frame_executor, self.frame_window)
+        # 提前返回时立即关闭帧生成器，释放解码资源（如 ffmpeg 子进程）
+        with closing(frames):
+            try:
+                for frame_img, duration_ms in frames:
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.warning(f"{img_format}处理已取消，已完成 {writer.frame_count} 帧")
+                        writer.abort()
+                        return None
+
+                    if frame_img.size != target_size:
+                        padded_frame = PILImage.new(frame_img.mode, target_size, "white")
+                        padded_frame.paste(frame_img, (0, 0))
+                        logger.debug(
+                            f"第 {writer.frame_count} 帧已填充至统一尺寸 {target_size[0]}x{target_size[1]}"
+                        )
+                        frame_img = padded_frame
+
+                    with timed_stage("encode"):
+                        writer.write(frame_img, duration_ms)
+            except BaseException:
+                writer.abort()
+                raise
+
+        frame_count = writer.frame_count
+        logger.info(
+            f"{img_format}处理完成，共处理 {frame_stats.get('source_frames', 0)} 帧，"
+            f"抽帧间隔 {stride}，抽掉 {frame_stats.get('skipped_frames', 0)} 帧，"
+            f"合并重复帧 {frame_stats.get('dropped_frames', 0)} 帧，输出 {frame_count} 帧"
+        )
+
+        if frame_count == 0:
+            logger.error(f"没有成功处理的{img_format}帧")
+            return None
+
+        with timed_stage("encode"):
+            writer.close()
+        result_bytes = output.getvalue()
+        logger.info(
+            f"{img_format}字符画生成成功，输出格式: {self.animated_format.upper()}，大小: {len(result_bytes)} bytes，帧尺寸 {target_size[0]}x{target_size[1]}"
+        )
+        return result_bytes
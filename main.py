@@ -1,59 +1,667 @@
-import io
 import ssl
-import imageio
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import math
+import mmap
+import threading
 import httpx
-import tempfile
+import time
 import os
-from typing import List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 from pathlib import Path
 
-from PIL import Image as PILImage, ImageDraw, ImageFont, ImageSequence
+from PIL import Image as PILImage
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
-from astrbot.api import logger
+from astrbot.api import AstrBotConfig, logger
 from astrbot.api.message_components import Image, Plain
 try:
     from astrbot.api.message_components import Reply
 except ImportError:
     Reply = None
+try:
+    from astrbot.api.message_components import Video
+except ImportError:
+    Video = None
+
+from .engine import (
+    DEFAULT_CACHE_DISK_MB,
+    DEFAULT_CACHE_MEMORY_MB,
+    DEFAULT_FONT_PATH,
+    FONT_SIZE,
+    IMAGE_OUTPUT,
+    TEXT_OUTPUT_EXTS,
+    VIDEO_HEADER_BYTES,
+    CharPicEngine,
+    ImageData,
+    ImageRejected,
+    OutputOptions,
+    ResultCache,
+    ScratchDir,
+    SourceData,
+    StageTimer,
+    VideoFile,
+    current_timer,
+    detect_format_from_bytes,
+    detect_video,
+    expand_runs,
+    get_glyph_atlas,
+    open_image,
+    open_video_file,
+    parse_output_options,
+    set_logger,
+    timed_stage,
+)
+
+# 转换引擎的日志统一输出到 AstrBot
+set_logger(logger)
+
+# 可作为输入的消息组件（图片，以及 AstrBot 支持时的视频）
+MEDIA_COMPONENTS = tuple(c for c in (Image, Video) if c is not None)
+
+# 转换线程池默认配置（可在插件配置中覆盖）
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_MAX_QUEUE = 4
+DEFAULT_JOB_TIMEOUT = 60.0
+
+# 文本超过该长度时改为发送图片（可在插件配置中覆盖）
+DEFAULT_TEXT_MAX_LENGTH = 3000
+
+# 结果发送方式："memory" 直接以字节发送，"file" 经由临时目录中的文件发送
+DEFAULT_SEND_MODE = "memory"
+SEND_MODES = ("memory", "file")
 
-# 字体配置
-DEFAULT_FONT_PATH = Path(__file__).parent / "font" / "consola.ttf"
-FONT_SIZE = 14
-# 字体宽高比补偿系数 (字符宽度/字符高度)
-# 大多数等宽字体的宽度约为高度的 0.5-0.6 倍
-FONT_ASPECT_RATIO = 0.55
-
-# 字符映射
-STR_MAP = "@@$$&B88QMMGW##EE93SPPDOOU**==()+^,\"--''.  "
-
-# 支持的动图格式
-ANIMATED_FORMATS = {'GIF', 'PNG', 'APNG', 'WEBP', 'MNG'}
-
-# 文件魔术字节（用于格式检测）
-MAGIC_BYTES = {
-    'GIF': b'GIF8',
-    'PNG': b'\x89PNG\r\n\x1a\n',
-    'WEBP': b'RIFF',
-    'MNG': b'\x8aMNG\r\n\x1a\n'
+# 多图消息默认配置（可在插件配置中覆盖）：单条指令最多处理的图片数、同时转换数、共享的处理预算（百万像素）
+DEFAULT_MAX_BATCH_IMAGES = 4
+DEFAULT_BATCH_CONCURRENCY = 2
+DEFAULT_BATCH_BUDGET_MPX = 600.0
+# 多图结果的发送形式："separate" 逐张发送，"sheet" 将静态结果拼成一张图
+DEFAULT_BATCH_LAYOUT = "separate"
+BATCH_LAYOUT_ALIASES = {
+    "separate": "separate", "分开": "separate",
+    "sheet": "sheet", "拼图": "sheet",
 }
 
-# SSL配置
-SSL_CONTEXT = ssl.create_default_context()
-SSL_CONTEXT.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1 | ssl.OP_NO_TLSv1_3
-SSL_CONTEXT.set_ciphers("HIGH:!aNULL:!MD5")
+# 网络下载默认配置（可在插件配置中覆盖）
+DEFAULT_HTTP_CONNECT_TIMEOUT = 5.0
+DEFAULT_HTTP_READ_TIMEOUT = 15.0
+DEFAULT_HTTP_MAX_CONNECTIONS = 10
+DEFAULT_HTTP_MAX_KEEPALIVE = 5
+DEFAULT_HTTP_RETRIES = 2
+DEFAULT_HTTP_RETRY_BACKOFF = 0.5
+DEFAULT_HTTP_CACHE_MB = 16
+# 服务端要求等待（Retry-After）时最多等待的秒数
+MAX_RETRY_AFTER = 10.0
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# 准入控制默认配置（可在插件配置中覆盖），成本单位为百万像素（Mpx），速率为每秒恢复量
+DEFAULT_USER_RATE_MPX = 5.0
+DEFAULT_USER_BURST_MPX = 600.0
+DEFAULT_GROUP_RATE_MPX = 15.0
+DEFAULT_GROUP_BURST_MPX = 1500.0
+DEFAULT_MAX_INFLIGHT_MPX = 600.0
+# 全局容量不足时建议用户等待的秒数
+GLOBAL_RETRY_AFTER = 10.0
+# 令牌桶数量超过该值时清理已回满的桶
+MAX_IDLE_BUCKETS = 1024
+
+# 输入图片限制默认配置（可在插件配置中覆盖）
+DEFAULT_MAX_DOWNLOAD_MB = 20
+DEFAULT_MAX_IMAGE_PIXELS = 40_000_000
+DEFAULT_MAX_FRAMES = 1000
+# 下载累计到该字节数后开始尝试解析文件头
+PROBE_BYTES = 64 * 1024
+
+# 统计延迟直方图的桶上界（毫秒），最后一个桶收纳更慢的样本
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, float("inf"))
+# 各处理阶段（按流程顺序），total 为整个请求的耗时
+STAGES = ("fetch", "decode", "gray_resize", "char_map", "render", "encode", "temp_write", "send", "total")
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图，按桶内线性插值估算分位数"""
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for idx, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = LATENCY_BUCKETS_MS[idx - 1] if idx else 0.0
+                upper = LATENCY_BUCKETS_MS[idx]
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return LATENCY_BUCKETS_MS[-2]
+
+
+class Metrics:
+    """进程内的请求计数与分阶段延迟直方图（按静态/动图及输入格式区分）"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_job(self, timer: StageTimer, outcome: str):
+        """请求结束时汇总其计数器和各阶段耗时"""
+        timer.add("total", time.perf_counter() - timer.started)
+        stages = timer.snapshot()
+        with self._lock:
+            self.counters["requests"] = self.counters.get("requests", 0) + 1
+            self.counters[f"outcome.{outcome}"] = self.counters.get(f"outcome.{outcome}", 0) + 1
+            for stage, seconds in stages.items():
+                key = (timer.kind, timer.fmt, stage)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = LatencyHistogram()
+                histogram.observe(seconds * 1000)
+
+    def report(self) -> str:
+        """生成可读的统计报告"""
+        with self._lock:
+            lines = ["字符画统计（自插件启动以来）"]
+            lines.append("计数: " + ("，".join(f"{k}={v}" for k, v in sorted(self.counters.items())) or "无"))
+            groups = sorted({(kind, fmt) for kind, fmt, _ in self.histograms})
+            for kind, fmt in groups:
+                lines.append(f"[{kind}/{fmt}] 阶段耗时 ms (p50/p95/p99, 次数)")
+                for stage in STAGES:
+                    histogram = self.histograms.get((kind, fmt, stage))
+                    if histogram is None:
+                        continue
+                    lines.append(
+                        f"  {stage}: {histogram.percentile(0.5):.1f}/{histogram.percentile(0.95):.1f}/"
+                        f"{histogram.percentile(0.99):.1f}, {histogram.count}"
+                    )
+            return "\n".join(lines)
+
+
+class DownloadError(Exception):
+    """图片下载或读取失败"""
+
+
+class CoalescedJobCancelled(Exception):
+    """共享的计算被其发起者取消"""
+
+
+class SingleFlight:
+    """合并相同键的并发计算：同一时刻只有一个发起者执行，其他请求等待并共享结果
+
+    发起者失败时异常原样传递给所有等待者；发起者被取消时等待者收到 CoalescedJobCancelled。
+    等待者自身被取消不会影响共享的计算。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.joined = 0
+
+    async def do(self, key: str, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或加入 key 对应的计算，返回 (结果, 是否为共享结果)"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.joined += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.set_exception(CoalescedJobCancelled("共享的字符画任务已被取消"))
+            future.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
+
+
+class PoolBusyError(Exception):
+    """转换线程池已满，拒绝新任务"""
+
+
+class ConversionPool:
+    """在线程池中运行字符画转换任务，避免阻塞事件循环
+
+    Pillow 的解码/缩放/编码以及 numpy 的批量索引都会释放 GIL，
+    因此线程池即可让 CPU 工作与事件循环并行。
+    任务总数（运行中 + 排队中）受 max_workers + max_queue 限制，超出时立即拒绝；
+    超时或被取消的任务通过 cancel_event 协作式停止。
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, timeout: float):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="charpic")
+        self.capacity = self.max_workers + max(0, max_queue)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._cancel_events: set = set()
+        self._closed = False
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """提交任务并等待结果，func 需接受关键字参数 cancel_event"""
+        if self._closed:
+            raise RuntimeError("转换线程池已关闭")
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError("转换任务过多")
+
+        cancel_event = threading.Event()
+        self._cancel_events.add(cancel_event)
+        try:
+            future = self._executor.submit(
+                contextvars.copy_context().run, partial(func, *args, cancel_event=cancel_event)
+            )
+        except RuntimeError:
+            self._cancel_events.discard(cancel_event)
+            self._slots.release()
+            raise
+
+        def _on_done(_future):
+            # 任务真正结束（包括超时后协作式退出）时才释放名额
+            self._cancel_events.discard(cancel_event)
+            self._slots.release()
+
+        future.add_done_callback(_on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            cancel_event.set()
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        """取消排队任务、通知运行中的任务停止，并关闭线程池"""
+        self._closed = True
+        for cancel_event in list(self._cancel_events):
+            cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AdmissionRejected(Exception):
+    """任务未获准入，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒恢复 rate 个令牌"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        """按流逝时间恢复令牌并返回当前余额"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """余额足够支付 cost 时返回 0，否则返回需要等待的秒数"""
+        cost = min(cost, self.capacity)
+        missing = cost - self.refill(now)
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else math.inf
+
+
+class RequestBudget:
+    """单条指令内多张图片共享的处理预算（百万像素），按各图片的估算成本扣除"""
+
+    def __init__(self, total_mpx: float):
+        self.total = total_mpx
+        self.remaining = total_mpx
+
+    def charge(self, cost: float):
+        if cost > self.remaining:
+            raise ImageRejected(f"本条指令的图片合计超出 {self.total:g} 百万像素的处理预算")
+        self.remaining -= cost
+
 
-# HTTP客户端
-HTTP_CLIENT = httpx.AsyncClient(verify=SSL_CONTEXT)
+class AdmissionController:
+    """在执行重任务前按估算成本准入
+
+    每个用户和每个群各有一个令牌桶（速率或容量为 0 时不限制），
+    全局同时限制准入中的任务数和这些任务的成本总和。
+    单个任务的成本超过桶容量或全局上限时按上限计，保证其在空闲时总能被接受。
+    """
+
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        group_rate: float,
+        group_burst: float,
+        max_jobs: int,
+        max_inflight_cost: float,
+    ):
+        self.user_limit = (user_rate, user_burst)
+        self.group_limit = (group_rate, group_burst)
+        self.max_jobs = max_jobs
+        self.max_inflight_cost = max_inflight_cost
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._jobs = 0
+        self._inflight_cost = 0.0
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, user_id: str, group_id: str, now: float) -> List[TokenBucket]:
+        """取出（必要时创建）用户和群对应的令牌桶"""
+        buckets = []
+        for scope, key, (rate, burst) in (("user", user_id, self.user_limit), ("group", group_id, self.group_limit)):
+            if not key or rate <= 0 or burst <= 0:
+                continue
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst, now)
+            buckets.append(bucket)
+        return buckets
+
+    def _prune(self, now: float):
+        """删除已回满的令牌桶，它们与新建的桶没有区别"""
+        for key, bucket in list(self._buckets.items()):
+            if bucket.refill(now) >= bucket.capacity:
+                del self._buckets[key]
+
+    def check(self, user_id: str, group_id: str, cost: float = 1.0):
+        """不扣除令牌地检查用户和群是否还有余额，用于在下载前快速拒绝"""
+        now = time.monotonic()
+        with self._lock:
+            wait = max((b.wait_time(cost, now) for b in self._buckets_for(user_id, group_id, now)), default=0.0)
+        if wait > 0:
+            raise AdmissionRejected("请求过于频繁", wait)
+
+    @contextmanager
+    def admit(self, user_id: str, group_id: str, cost: float) -> Iterator[None]:
+        """扣除令牌并占用全局容量，退出时归还全局容量；无法准入时抛出 AdmissionRejected"""
+        now = time.monotonic()
+        with self._lock:
+            global_cost = min(cost, self.max_inflight_cost) if self.max_inflight_cost > 0 else 0.0
+            if self._jobs >= self.max_jobs or (
+                global_cost > 0 and self._inflight_cost + global_cost > self.max_inflight_cost
+            ):
+                raise AdmissionRejected("当前字符画任务较多", GLOBAL_RETRY_AFTER)
+            buckets = self._buckets_for(user_id, group_id, now)
+            wait = max((b.wait_time(cost, now) for b in buckets), default=0.0)
+            if wait > 0:
+                raise AdmissionRejected("请求过于频繁", wait)
+            for bucket in buckets:
+                bucket.tokens -= min(cost, bucket.capacity)
+            self._jobs += 1
+            self._inflight_cost += global_cost
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._jobs -= 1
+                self._inflight_cost -= global_cost
+
+    def stats(self) -> Dict[str, Any]:
+        """当前准入状态"""
+        with self._lock:
+            return {
+                "jobs": self._jobs,
+                "inflight_mpx": round(self._inflight_cost, 1),
+                "buckets": len(self._buckets),
+            }
+
+
+class FetchPolicy(NamedTuple):
+    """网络下载参数"""
+
+    connect_timeout: float
+    read_timeout: float
+    max_connections: int
+    max_keepalive: int
+    retries: int
+    retry_backoff: float
+    http2: bool
+    disable_tls13: bool
+
+
+def _build_ssl_context(disable_tls13: bool) -> ssl.SSLContext:
+    """创建 TLS 配置；disable_tls13 仅用于兼容 TLS 1.3 握手异常的个别图片服务器，默认不启用"""
+    context = ssl.create_default_context()
+    context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    if disable_tls13:
+        context.options |= ssl.OP_NO_TLSv1_3
+    context.set_ciphers("HIGH:!aNULL:!MD5")
+    return context
+
+
+class ValidatorEntry(NamedTuple):
+    """条件请求缓存项：响应的校验器与正文"""
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    data: bytes
+
+
+class ImageFetcher:
+    """带连接池限制、超时、重试和条件请求缓存的 HTTP 下载器
+
+    在插件 initialize() 中创建客户端，terminate() 中关闭。
+    带有 ETag/Last-Modified 的响应按 URL 缓存，再次请求时发送条件请求，
+    服务器返回 304 时直接复用缓存的正文，无需重新下载。
+    仅在连接失败、超时或可重试状态码（尚未读取正文）时重试，间隔按指数退避。
+    """
+
+    def __init__(self, policy: FetchPolicy, cache_budget: int):
+        self.policy = policy
+        self.cache_budget = cache_budget
+        self.client: Optional[httpx.AsyncClient] = None
+        self._cache: "OrderedDict[str, ValidatorEntry]" = OrderedDict()
+        self._cache_size = 0
+        self.stats = {"requests": 0, "revalidated": 0, "retries": 0}
+
+    def start(self):
+        """创建 HTTP 客户端（重复调用无副作用）"""
+        if self.client is not None:
+            return
+        http2 = self.policy.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，HTTP/2 不可用，改用 HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            verify=_build_ssl_context(self.policy.disable_tls13),
+            http2=http2,
+            follow_redirects=True,
+            timeout=httpx.Timeout(self.policy.read_timeout, connect=self.policy.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.policy.max_connections,
+                max_keepalive_connections=self.policy.max_keepalive,
+            ),
+        )
+
+    async def aclose(self):
+        """关闭 HTTP 客户端并释放连接"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def fetch(
+        self, url: str, read_body: Callable[[httpx.Response], Awaitable[Optional[SourceData]]]
+    ) -> Optional[SourceData]:
+        """下载 url，返回 read_body 读取的正文；状态码不是 200/304 时返回 None
+
+        read_body 负责流式读取并检查正文，可抛出异常中止下载（此类异常不会重试）。
+        """
+        self.start()
+        entry = self._cache_get(url)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
+            delay = None
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and entry is not None:
+                        self.stats["revalidated"] += 1
+                        logger.info(f"图片 {url} 未修改，复用已下载的内容")
+                        return entry.data
+                    if response.status_code in RETRYABLE_STATUS and attempt < self.policy.retries:
+                        delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                        logger.warning(f"图片 {url} 下载失败: {response.status_code}，{delay:.2g}s 后重试")
+                    elif response.status_code != 200:
+                        logger.warning(f"图片 {url} 下载失败: {response.status_code}")
+                        return None
+                    else:
+                        data = await read_body(response)
+                        self._cache_put(url, response.headers, data)
+                        return data
+            except httpx.TransportError as e:
+                # 包括连接失败、超时和连接被中断
+                if attempt >= self.policy.retries:
+                    raise
+                delay = self._retry_delay(attempt, None)
+                logger.warning(f"图片 {url} 下载出错: {e!r}，{delay:.2g}s 后重试")
+
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """第 attempt 次重试前的等待秒数，服务端给出 Retry-After 时以其为准"""
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        return self.policy.retry_backoff * (2 ** attempt)
+
+    def _cache_get(self, url: str) -> Optional[ValidatorEntry]:
+        """取出 URL 对应的条件请求缓存项"""
+        entry = self._cache.get(url)
+        if entry is not None:
+            self._cache.move_to_end(url)
+        return entry
+
+    def _cache_put(self, url: str, response_headers: httpx.Headers, data: Optional[SourceData]):
+        """缓存带校验器的响应，超出预算时淘汰最久未使用的项
+
+        直接写入临时文件的视频用完即删除，不缓存。
+        """
+        etag = response_headers.get("ETag")
+        last_modified = response_headers.get("Last-Modified")
+        old = self._cache.pop(url, None)
+        if old is not None:
+            self._cache_size -= len(old.data)
+        if not isinstance(data, bytes) or not data or not (etag or last_modified) or len(data) > self.cache_budget:
+            return
+        self._cache[url] = ValidatorEntry(etag, last_modified, data)
+        self._cache_size += len(data)
+        while self._cache_size > self.cache_budget:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= len(evicted.data)
+
+
+# 单张图片下载或转换失败时可向用户说明原因的异常
+CONVERSION_ERRORS = (DownloadError, ImageRejected, AdmissionRejected, PoolBusyError, asyncio.TimeoutError, CoalescedJobCancelled)
 
 
 @register("charpic", "移植自1umine的nonebot_plugin_charpic", "将图片转换为ASCII艺术字符画的插件，支持静态图片和动图（GIF/APNG/WebP/MNG）", "1.0.0")
 class CharPicPlugin(Star):
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, config: Optional[AstrBotConfig] = None):
         super().__init__(context)
+        self.config = config or {}
+        self.pool = ConversionPool(
+            max_workers=int(self.config.get("max_workers", DEFAULT_MAX_WORKERS)),
+            max_queue=int(self.config.get("max_queue", DEFAULT_MAX_QUEUE)),
+            timeout=float(self.config.get("job_timeout", DEFAULT_JOB_TIMEOUT)),
+        )
+        self.metrics = Metrics()
+        self.inflight = SingleFlight()
+        self.admission = AdmissionController(
+            user_rate=float(self.config.get("user_rate_mpx", DEFAULT_USER_RATE_MPX)),
+            user_burst=float(self.config.get("user_burst_mpx", DEFAULT_USER_BURST_MPX)),
+            group_rate=float(self.config.get("group_rate_mpx", DEFAULT_GROUP_RATE_MPX)),
+            group_burst=float(self.config.get("group_burst_mpx", DEFAULT_GROUP_BURST_MPX)),
+            max_jobs=self.pool.capacity,
+            max_inflight_cost=float(self.config.get("max_inflight_mpx", DEFAULT_MAX_INFLIGHT_MPX)),
+        )
+        self.max_download_bytes = int(float(self.config.get("max_download_mb", DEFAULT_MAX_DOWNLOAD_MB)) * 1024 * 1024)
+        self.max_image_pixels = int(self.config.get("max_image_pixels", DEFAULT_MAX_IMAGE_PIXELS))
+        self.max_frames = int(self.config.get("max_frames", DEFAULT_MAX_FRAMES))
+        self.fetcher = ImageFetcher(
+            FetchPolicy(
+                connect_timeout=float(self.config.get("http_connect_timeout", DEFAULT_HTTP_CONNECT_TIMEOUT)),
+                read_timeout=float(self.config.get("http_read_timeout", DEFAULT_HTTP_READ_TIMEOUT)),
+                max_connections=int(self.config.get("http_max_connections", DEFAULT_HTTP_MAX_CONNECTIONS)),
+                max_keepalive=int(self.config.get("http_max_keepalive", DEFAULT_HTTP_MAX_KEEPALIVE)),
+                retries=max(0, int(self.config.get("http_retries", DEFAULT_HTTP_RETRIES))),
+                retry_backoff=float(self.config.get("http_retry_backoff", DEFAULT_HTTP_RETRY_BACKOFF)),
+                http2=bool(self.config.get("http2", False)),
+                disable_tls13=bool(self.config.get("http_disable_tls13", False)),
+            ),
+            cache_budget=int(float(self.config.get("http_cache_mb", DEFAULT_HTTP_CACHE_MB)) * 1024 * 1024),
+        )
+        self.send_mode = str(self.config.get("send_mode", DEFAULT_SEND_MODE)).lower()
+        if self.send_mode not in SEND_MODES:
+            logger.warning(f"不支持的发送方式 {self.send_mode}，使用 {DEFAULT_SEND_MODE}")
+            self.send_mode = DEFAULT_SEND_MODE
+        self.file_send_platforms = set(self.config.get("file_send_platforms") or [])
+        self.scratch = ScratchDir()
+        # 字符映射、缩放、渲染与编码均由引擎完成，插件只负责消息收发、下载、准入和缓存
+        self.engine = CharPicEngine.from_config(self.config, scratch=self.scratch)
+        self.text_max_length = int(self.config.get("text_max_length", DEFAULT_TEXT_MAX_LENGTH))
+        self.max_batch_images = max(1, int(self.config.get("max_batch_images", DEFAULT_MAX_BATCH_IMAGES)))
+        # 单条指令同时占用的转换线程不超过线程池大小
+        self.batch_concurrency = min(
+            max(1, int(self.config.get("batch_concurrency", DEFAULT_BATCH_CONCURRENCY))), self.pool.max_workers
+        )
+        self.batch_budget_mpx = float(self.config.get("batch_budget_mpx", DEFAULT_BATCH_BUDGET_MPX))
+        self.batch_layout = BATCH_LAYOUT_ALIASES.get(
+            str(self.config.get("batch_layout", DEFAULT_BATCH_LAYOUT)).lower(), DEFAULT_BATCH_LAYOUT
+        )
+        self.cache = ResultCache(
+            memory_budget=int(float(self.config.get("cache_memory_mb", DEFAULT_CACHE_MEMORY_MB)) * 1024 * 1024),
+            disk_dir=self.config.get("cache_disk_dir") or None,
+            disk_budget=int(float(self.config.get("cache_disk_mb", DEFAULT_CACHE_DISK_MB)) * 1024 * 1024),
+        )
 
     async def initialize(self):
         """插件初始化"""
+        self.fetcher.start()
         logger.info("字符画插件初始化完成")
         
         # 检查字体文件
@@ -61,72 +669,101 @@ class CharPicPlugin(Star):
             logger.warning(f"字体文件不存在: {DEFAULT_FONT_PATH}")
         else:
             try:
-                # 尝试加载字体文件
-                ImageFont.truetype(str(DEFAULT_FONT_PATH), FONT_SIZE)
-                logger.info("字体文件加载成功")
+                # 尝试加载字体文件并预热字形图集
+                atlas = get_glyph_atlas(str(DEFAULT_FONT_PATH), FONT_SIZE)
+                logger.info(f"字体文件加载成功，字符单元尺寸: {atlas.cell_w}x{atlas.cell_h}")
             except Exception as e:
                 logger.error(f"字体文件加载失败: {e}")
 
     @filter.command("字符画", "charpic")
     async def charpic_handler(self, event: AstrMessageEvent):
-        """字符画生成指令处理器"""
+        """字符画生成指令处理器
+
+        子命令 `stats`（仅管理员）输出各阶段耗时统计；`color` 输出彩色字符画；
+        `text [宽度]` / `rle [宽度]` 直接以文本（或 ANSI 压缩文本）返回字符画，不渲染图片。
+        消息中有多张图片时并发转换（最多 max_batch_images 张），`拼图`/`sheet` 将静态结果拼成一张发送。
+        """
+        args = self._parse_command_args(event)
+        if args and args[0].lower() in ("stats", "统计"):
+            if not self._is_admin(event):
+                yield event.plain_result("只有管理员可以查看字符画统计")
+                return
+            yield event.plain_result(
+                f"{self.metrics.report()}\n缓存: {self.cache.stats()}\n合并的并发请求: {self.inflight.joined}\n准入: {self.admission.stats()}\n下载: {self.fetcher.stats}"
+            )
+            return
+
+        # 拼图/分开 参数可出现在任意位置，其余参数决定输出形式
+        layouts = [BATCH_LAYOUT_ALIASES[a.lower()] for a in args if a.lower() in BATCH_LAYOUT_ALIASES]
+        layout = layouts[-1] if layouts else self.batch_layout
+        options = parse_output_options([a for a in args if a.lower() not in BATCH_LAYOUT_ALIASES])
+
+        timer = StageTimer()
+        current_timer.set(timer)
+        outcome = "failed"
         try:
             logger.info(f"收到字符画生成请求，来自用户: {event.get_sender_name()}")
             
             # 获取消息中的图片
-            image_url = await self._get_image_from_message(event)
+            image_urls = await self._get_images_from_message(event)
             
-            if not image_url:
+            if not image_urls:
                 logger.warning("未找到图片URL")
+                outcome = "no_image"
                 yield event.plain_result("请发送图片并使用 /字符画 指令，或者回复一条包含图片的消息使用 /字符画")
                 return
 
-            logger.info(f"找到图片URL: {image_url}")
-            yield event.plain_result("正在生成字符画，请稍候...")
+            ignored = len(image_urls) - self.max_batch_images
+            if ignored > 0:
+                logger.info(f"找到 {len(image_urls)} 张图片，只处理前 {self.max_batch_images} 张")
+                image_urls = image_urls[:self.max_batch_images]
+            logger.info(f"找到图片URL: {', '.join(map(str, image_urls))}")
 
-            # 下载图片
-            img = await self._download_image(image_url)
-            if not img:
-                logger.error("图片下载失败")
-                yield event.plain_result("图片下载失败，请稍后再试")
+            # 用户或群的令牌已耗尽时在下载前直接拒绝
+            requester = self._get_requester(event)
+            try:
+                self.admission.check(*requester)
+            except AdmissionRejected as e:
+                logger.info(f"请求被限流: {requester}, {e.reason}")
+                outcome = "throttled"
+                yield event.plain_result(self._retry_hint(e))
                 return
 
-            logger.info(f"成功下载图片，尺寸: {img.size}, 格式: {img.format}")
+            if len(image_urls) > 1:
+                notice = f"正在生成 {len(image_urls)} 张字符画，请稍候..."
+                if ignored > 0:
+                    notice += f"（每条指令最多 {self.max_batch_images} 张，其余 {ignored} 张已忽略）"
+                yield event.plain_result(notice)
+                results = await self._convert_batch(image_urls, requester, options)
+                timer.kind, timer.fmt = "batch", f"x{len(image_urls)}"
+                outcome = "ok" if any(isinstance(r, tuple) and r[0] for r in results) else "failed"
+                async for result in self._send_batch(event, results, requester, layout):
+                    yield result
+                return
 
-            # 检测是否为动图
-            is_animated = self._is_animated(img)
-            
-            if is_animated:
-                frame_count = self._get_frame_count(img)
-                logger.info(f"检测到动图，格式: {img.format}, 帧数: {frame_count}")
-                result_bytes = await self._process_animated_image(img)
-                file_ext = "gif"
-            else:
-                logger.info(f"开始处理静态图片，格式: {img.format}")
-                result_bytes = await self._process_static_image(img)
-                file_ext = "png"
+            image_url = image_urls[0]
+            yield event.plain_result("正在生成字符画，请稍候...")
+
+            # 相同图片与参数的并发请求共享同一次下载和转换
+            try:
+                (result_bytes, file_ext), shared = await self.inflight.do(
+                    f"url:{image_url}|{self.engine.cache_params(options)}",
+                    lambda: self._download_and_convert(image_url, requester, options),
+                )
+                if shared:
+                    timer.kind = "coalesced"
+                    logger.info("相同图片正在生成中，已共享其结果")
+                # 超长文本改为渲染图片时同样占用转换线程，可能繁忙或超时
+                result_bytes, file_ext = await self._fit_text_result(result_bytes, file_ext)
+            except CONVERSION_ERRORS as e:
+                outcome, reply = self._describe_failure(e, requester)
+                yield event.plain_result(reply)
+                return
 
             if result_bytes:
-                logger.info(f"字符画生成成功，大小: {len(result_bytes)} bytes")
-                
-                # 保存到临时文件
-                try:
-                    with tempfile.NamedTemporaryFile(mode='wb', suffix=f'.{file_ext}', delete=False) as temp_file:
-                        temp_file.write(result_bytes)
-                        temp_path = temp_file.name
-                    
-                    logger.info(f"字符画已保存到临时文件: {temp_path}")
-                    yield event.image_result(temp_path)
-                    
-                    # 发送后删除临时文件
-                    try:
-                        os.unlink(temp_path)
-                        logger.info(f"已删除临时文件: {temp_path}")
-                    except Exception as e:
-                        logger.warning(f"删除临时文件失败: {e}")
-                except Exception as e:
-                    logger.error(f"保存临时文件失败: {e}")
-                    yield event.plain_result("字符画生成失败")
+                for result in self._result_messages(event, result_bytes, file_ext):
+                    yield result
+                outcome = "ok"
             else:
                 logger.error("字符画生成失败")
                 yield event.plain_result("字符画生成失败")
@@ -134,9 +771,277 @@ class CharPicPlugin(Star):
         except Exception as e:
             logger.error(f"字符画生成出错: {e}")
             yield event.plain_result(f"生成字符画时出错: {str(e)}")
+        finally:
+            self.metrics.record_job(timer, outcome)
+            current_timer.set(None)
+
+    def _describe_failure(self, e: BaseException, requester: Tuple[str, str]) -> Tuple[str, str]:
+        """记录失败原因，返回 (统计结果, 回复文本)"""
+        if isinstance(e, DownloadError):
+            logger.error("图片下载失败")
+            return "download_failed", "图片下载失败，请稍后再试"
+        if isinstance(e, ImageRejected):
+            logger.warning(f"图片超出限制: {e}")
+            return "rejected", f"无法生成字符画：{e}"
+        if isinstance(e, AdmissionRejected):
+            logger.info(f"任务未获准入: {requester}, {e.reason}")
+            return "throttled", self._retry_hint(e)
+        if isinstance(e, PoolBusyError):
+            logger.warning("转换线程池已满，拒绝本次请求")
+            return "busy", "当前字符画任务较多，请稍后再试"
+        if isinstance(e, asyncio.TimeoutError):
+            logger.warning(f"字符画生成超时（{self.pool.timeout}s）")
+            return "timeout", "字符画生成超时，请尝试更小的图片"
+        if isinstance(e, CoalescedJobCancelled):
+            logger.warning(str(e))
+            return "cancelled", "字符画生成被中断，请重试"
+        logger.error(f"字符画生成出错: {e}")
+        return "failed", f"生成字符画时出错: {str(e)}"
+
+    async def _fit_text_result(self, result_bytes: Optional[bytes], file_ext: str) -> Tuple[Optional[bytes], str]:
+        """文本结果超出平台消息长度时改为渲染成图片，返回 (结果字节, 文件扩展名)"""
+        if not result_bytes or file_ext not in TEXT_OUTPUT_EXTS.values():
+            return result_bytes, file_ext
+        text = result_bytes.decode("utf-8")
+        if len(text) <= self.text_max_length:
+            return result_bytes, file_ext
+        logger.info(f"字符文本长度 {len(text)} 超过 {self.text_max_length}，改为发送图片")
+        return await self.pool.run(self.engine.render_text_png, expand_runs(text)), "png"
+
+    def _result_messages(self, event: AstrMessageEvent, result_bytes: bytes, file_ext: str) -> Iterator[MessageEventResult]:
+        """产出单个结果的消息：文本结果为文字消息，其他为图片消息"""
+        if file_ext in TEXT_OUTPUT_EXTS.values():
+            text = result_bytes.decode("utf-8")
+            logger.info(f"字符文本生成成功，长度: {len(text)}")
+            with timed_stage("send"):
+                yield event.plain_result(text)
+            return
+
+        logger.info(f"字符画生成成功，大小: {len(result_bytes)} bytes")
+        with self._image_result(event, result_bytes, file_ext) as result:
+            with timed_stage("send"):
+                yield result
+
+    async def _convert_batch(
+        self, image_urls: List[str], requester: Tuple[str, str], options: OutputOptions = IMAGE_OUTPUT
+    ) -> List[Union[Tuple[Optional[bytes], str], BaseException]]:
+        """并发转换多张图片，按原顺序返回各自的 (结果字节, 文件扩展名)，失败的位置为异常
 
-    async def _get_image_from_message(self, event: AstrMessageEvent) -> Optional[str]:
-        """从消息中获取图片URL
+        各图片共享同一份处理预算（batch_budget_mpx），同时进行的下载与转换不超过 batch_concurrency 个，
+        单条指令不会占满共享的转换线程池。
+        """
+        budget = RequestBudget(self.batch_budget_mpx)
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        params = self.engine.cache_params(options)
+
+        async def convert_one(image_url: str) -> Tuple[Optional[bytes], str]:
+            async with semaphore:
+                result, shared = await self.inflight.do(
+                    f"url:{image_url}|{params}",
+                    lambda: self._download_and_convert(image_url, requester, options, budget),
+                )
+                if shared:
+                    logger.info(f"相同图片正在生成中，已共享其结果: {image_url}")
+                return result
+
+        return await asyncio.gather(*(convert_one(url) for url in image_urls), return_exceptions=True)
+
+    async def _send_batch(
+        self,
+        event: AstrMessageEvent,
+        results: List[Union[Tuple[Optional[bytes], str], BaseException]],
+        requester: Tuple[str, str],
+        layout: str,
+    ) -> AsyncIterator[MessageEventResult]:
+        """按原顺序发送多图结果；拼图模式下静态图片结果拼成一张发送，动图、文本和失败说明仍逐条发送"""
+        results = list(results)
+        outputs: List[Tuple[Optional[bytes], str]] = []
+        for index, result in enumerate(results):
+            if not isinstance(result, BaseException):
+                # 超长文本改为渲染图片时线程池繁忙或超时，只影响这一张
+                try:
+                    outputs.append(await self._fit_text_result(*result))
+                    continue
+                except CONVERSION_ERRORS as e:
+                    results[index] = e
+            outputs.append((None, ""))
+
+        in_sheet: List[int] = []
+        if layout == "sheet":
+            candidates = [index for index, (data, _) in enumerate(outputs) if data]
+            try:
+                sheet, included = await self.pool.run(
+                    self.engine.render_contact_sheet, [outputs[index] for index in candidates]
+                )
+            except (PoolBusyError, asyncio.TimeoutError) as e:
+                logger.warning(f"拼图未能生成，改为逐张发送: {e!r}")
+                sheet, included = None, []
+            if sheet:
+                in_sheet = [candidates[k] for k in included]
+                for message in self._result_messages(event, sheet, "png"):
+                    yield message
+
+        for index, (result, (data, ext)) in enumerate(zip(results, outputs)):
+            if index in in_sheet:
+                continue
+            if isinstance(result, BaseException):
+                _, reply = self._describe_failure(result, requester)
+                yield event.plain_result(f"第 {index + 1} 张：{reply}")
+            elif data:
+                for message in self._result_messages(event, data, ext):
+                    yield message
+            else:
+                logger.error(f"第 {index + 1} 张字符画生成失败")
+                yield event.plain_result(f"第 {index + 1} 张：字符画生成失败")
+
+    @contextmanager
+    def _image_result(self, event: AstrMessageEvent, data: bytes, ext: str) -> Iterator[MessageEventResult]:
+        """构造图片消息结果
+
+        支持时直接以字节构造图片组件，不经过磁盘；否则写入临时目录，
+        离开上下文（包括发送出错或生成器被关闭）时释放临时文件。
+        """
+        if self._send_in_memory(event):
+            yield event.chain_result([Image.fromBytes(data)])
+            return
+
+        with ExitStack() as stack:
+            with timed_stage("temp_write"):
+                path = stack.enter_context(self.scratch.file(data, ext))
+            logger.debug(f"字符画已写入临时文件: {path}")
+            yield event.image_result(path)
+
+    def _send_in_memory(self, event: AstrMessageEvent) -> bool:
+        """当前配置和平台是否以字节直接发送图片"""
+        if self.send_mode != "memory" or not hasattr(Image, "fromBytes"):
+            return False
+        try:
+            platform = event.get_platform_name()
+        except Exception:
+            platform = ""
+        return platform not in self.file_send_platforms
+
+    async def _download_and_convert(
+        self,
+        image_url: str,
+        requester: Tuple[str, str],
+        options: OutputOptions = IMAGE_OUTPUT,
+        budget: Optional[RequestBudget] = None,
+    ) -> Tuple[Optional[bytes], str]:
+        """下载图片并生成字符画（优先使用缓存），返回 (结果字节, 文件扩展名)
+
+        budget 为多图指令共享的处理预算，命中缓存时不扣除。
+        """
+        timer = current_timer.get()
+        with timed_stage("fetch"):
+            img_data = await self._download_image(image_url)
+        if not img_data:
+            raise DownloadError(image_url)
+
+        try:
+            # 相同图片与参数直接返回缓存结果；不同 URL 的相同内容按内容哈希合并
+            cache_key = ResultCache.make_key(img_data, self.engine.cache_params(options))
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                if timer is not None:
+                    timer.kind = "cached"
+                logger.info(f"命中字符画缓存，缓存统计: {self.cache.stats()}")
+                return cached
+
+            result, shared = await self.inflight.do(
+                f"hash:{cache_key}", lambda: self._convert_and_cache(img_data, cache_key, requester, options, budget)
+            )
+            if shared and timer is not None:
+                timer.kind = "coalesced"
+            return result
+        finally:
+            self._release_image_data(img_data)
+
+    @staticmethod
+    def _release_image_data(img_data: SourceData):
+        """转换或缓存查询结束后释放下载结果：本地文件的 mmap 立即关闭，不等待 GC；下载到临时目录的视频随即删除"""
+        if isinstance(img_data, VideoFile):
+            if img_data.temporary:
+                try:
+                    os.unlink(img_data.path)
+                except OSError as e:
+                    logger.warning(f"删除临时视频文件失败: {e}")
+            return
+        if isinstance(img_data, mmap.mmap):
+            try:
+                img_data.close()
+            except BufferError:
+                # 超时后仍在协作式退出的转换线程持有其缓冲区，此时交由 GC 回收
+                logger.debug("mmap 仍被转换线程使用，稍后由 GC 关闭")
+
+    async def _convert_and_cache(
+        self,
+        img_data: SourceData,
+        cache_key: str,
+        requester: Tuple[str, str],
+        options: OutputOptions = IMAGE_OUTPUT,
+        budget: Optional[RequestBudget] = None,
+    ) -> Tuple[Optional[bytes], str]:
+        """按估算成本准入后在线程池中转换图片（或视频），并写入缓存"""
+        video_ext = detect_video(img_data)
+        if video_ext:
+            size = img_data.size if isinstance(img_data, VideoFile) else len(img_data)
+            logger.info(f"成功下载视频，容器: {video_ext}，大小: {size} bytes")
+            cost = self.engine.estimate_video_cost(options)
+            convert: Callable[..., Tuple[Optional[bytes], str]] = self.engine.convert_video
+            source: Any = img_data
+        else:
+            img = open_image(img_data)
+            logger.info(f"成功下载图片，尺寸: {img.size}, 格式: {img.format}")
+            cost = await asyncio.to_thread(self.engine.estimate_cost, img, options)
+            convert, source = self.engine.convert_image, img
+
+        logger.info(f"估算转换成本: {cost:.1f} 百万像素")
+        if budget is not None:
+            budget.charge(cost)
+        with self.admission.admit(*requester, cost):
+            # 在线程池中转换，避免阻塞事件循环
+            result_bytes, file_ext = await self.pool.run(convert, source, options)
+        if result_bytes:
+            await asyncio.to_thread(self.cache.put, cache_key, result_bytes, file_ext)
+        return result_bytes, file_ext
+
+    @staticmethod
+    def _get_requester(event: AstrMessageEvent) -> Tuple[str, str]:
+        """返回 (用户 ID, 群 ID)，私聊时群 ID 为空"""
+        try:
+            user_id = str(event.get_sender_id() or "")
+        except Exception:
+            user_id = ""
+        try:
+            group_id = str(event.get_group_id() or "")
+        except Exception:
+            group_id = ""
+        return user_id, group_id
+
+    @staticmethod
+    def _retry_hint(e: AdmissionRejected) -> str:
+        """生成带重试建议的拒绝回复"""
+        return f"{e.reason}，请约 {max(1, math.ceil(e.retry_after))} 秒后再试（大图或长动图消耗的额度更多）"
+
+    @staticmethod
+    def _parse_command_args(event: AstrMessageEvent) -> List[str]:
+        """取出指令名之后的参数"""
+        tokens = (getattr(event, "message_str", "") or "").split()
+        if tokens and tokens[0].lstrip("/") in ("字符画", "charpic"):
+            tokens = tokens[1:]
+        return tokens
+
+    @staticmethod
+    def _is_admin(event: AstrMessageEvent) -> bool:
+        """判断发送者是否为 AstrBot 管理员"""
+        checker = getattr(event, "is_admin", None)
+        if callable(checker):
+            return bool(checker())
+        return getattr(event, "role", None) == "admin"
+
+    async def _get_images_from_message(self, event: AstrMessageEvent) -> List[str]:
+        """从消息中获取全部图片的URL（按出现顺序去重）
         
         支持两种方式获取图片：
         1. 从当前消息中直接获取图片
@@ -154,12 +1059,12 @@ class CharPicPlugin(Star):
             
             if not message_chain:
                 logger.warning("无法获取消息链")
-                return None
+                return []
             
             # 遍历消息链中的所有组件
             for component in message_chain:
                 # 方式一：从当前消息获取图片
-                if isinstance(component, Image):
+                if isinstance(component, MEDIA_COMPONENTS):
                     images.append(component)
                     logger.info("在当前消息中找到图片")
                 
@@ -169,7 +1074,7 @@ class CharPicPlugin(Star):
                     replied_chain = getattr(component, 'chain', None)
                     if replied_chain:
                         for reply_comp in replied_chain:
-                            if isinstance(reply_comp, Image):
+                            if isinstance(reply_comp, MEDIA_COMPONENTS):
                                 images.append(reply_comp)
                                 logger.info("在引用消息中找到图片")
             
@@ -183,44 +1088,44 @@ class CharPicPlugin(Star):
                     reply_chain = getattr(event.reply, 'message')
                 if reply_chain:
                     for reply_component in reply_chain:
-                        if isinstance(reply_component, Image):
+                        if isinstance(reply_component, MEDIA_COMPONENTS):
                             images.append(reply_component)
                         elif Reply is not None and isinstance(reply_component, Reply):
                             nested_chain = getattr(reply_component, 'chain', None)
                             if nested_chain:
                                 for nested_comp in nested_chain:
-                                    if isinstance(nested_comp, Image):
+                                    if isinstance(nested_comp, MEDIA_COMPONENTS):
                                         images.append(nested_comp)
                     if images:
                         logger.info("在回复消息中找到图片")
             
-            # 当找到多张图片时，使用第一张
             if len(images) > 1:
-                logger.info(f"找到 {len(images)} 张图片，使用第一张")
-            
-            if images:
-                image_component = images[0]
+                logger.info(f"找到 {len(images)} 张图片")
+
+            image_paths: List[str] = []
+            for image_component in images:
                 # 获取图片 URL/路径
                 # 尝试多个可能的属性名
                 for attr_name in ['file', 'url', 'image_url', 'image_file', 'path']:
-                    if hasattr(image_component, attr_name):
-                        image_path = getattr(image_component, attr_name)
-                        if image_path:
+                    image_path = getattr(image_component, attr_name, None)
+                    if image_path:
+                        if image_path not in image_paths:
                             logger.info(f"成功获取图片路径: {image_path}")
-                            return image_path
-                
-                logger.warning("图片组件存在但无法获取图片路径")
-                return None
-            
-            logger.info("未在消息或引用消息中找到图片")
-            return None
+                            image_paths.append(image_path)
+                        break
+                else:
+                    logger.warning("图片组件存在但无法获取图片路径")
+
+            if not images:
+                logger.info("未在消息或引用消息中找到图片")
+            return image_paths
             
         except Exception as e:
             logger.error(f"获取图片URL失败: {e}", exc_info=True)
-            return None
+            return []
 
-    async def _download_image(self, image_url: str) -> Optional[PILImage.Image]:
-        """下载图片，支持本地文件路径和网络URL"""
+    async def _download_image(self, image_url: str) -> Optional[SourceData]:
+        """下载图片原始字节，支持本地文件路径和网络URL；视频以 VideoFile 返回，不载入内存"""
         try:
             if not image_url:
                 return None
@@ -248,318 +1153,156 @@ class CharPicPlugin(Star):
                 if not os.path.exists(local_path):
                     logger.warning(f"本地图片不存在: {local_path}")
                     return None
-                with open(local_path, "rb") as f:
-                    img_data = f.read()
-                return PILImage.open(io.BytesIO(img_data))
-
-            response = await HTTP_CLIENT.get(image_url)
-            if response.status_code != 200:
-                logger.warning(f"图片 {image_url} 下载失败: {response.status_code}")
-                return None
+                # 完整检查会遍历动图的全部帧，放到线程中执行，不阻塞事件循环
+                return await asyncio.to_thread(self._map_local_image, local_path)
 
-            img = PILImage.open(io.BytesIO(response.content))
-            return img
+            return await self._fetch_remote_image(image_url)
+        except ImageRejected:
+            raise
         except Exception as e:
             logger.error(f"下载图片时出错: {e}")
             return None
 
-    def _detect_format_from_bytes(self, img_bytes: bytes) -> Optional[str]:
-        """根据文件头（魔术字节）检测图片格式"""
-        try:
-            if img_bytes.startswith(MAGIC_BYTES['GIF']):
-                return 'GIF'
-            elif img_bytes.startswith(MAGIC_BYTES['PNG']):
-                return 'PNG'
-            elif img_bytes.startswith(MAGIC_BYTES['MNG']):
-                return 'MNG'
-            elif img_bytes.startswith(MAGIC_BYTES['WEBP']):
-                if b'WEBP' in img_bytes[:20]:
-                    return 'WEBP'
-            return None
-        except Exception as e:
-            logger.error(f"检测图片格式时出错: {e}")
-            return None
+    def _map_local_image(self, local_path: str) -> Optional[Union[mmap.mmap, VideoFile]]:
+        """以只读 mmap 打开本地图片，并在返回前检查大小和文件头
 
-    def _is_animated(self, img: PILImage.Image) -> bool:
-        """检测图片是否为动图"""
-        try:
-            if img.format == 'GIF':
-                try:
-                    img.seek(1)
-                    img.seek(0)
-                    return True
-                except EOFError:
-                    return False
-            
-            if img.format in ('PNG', 'APNG'):
-                if hasattr(img, 'n_frames') and img.n_frames > 1:
-                    return True
-                try:
-                    img.seek(1)
-                    img.seek(0)
-                    return True
-                except (EOFError, AttributeError):
-                    return False
-            
-            if img.format == 'WEBP':
-                if hasattr(img, 'n_frames') and img.n_frames > 1:
-                    return True
-                try:
-                    img.seek(1)
-                    img.seek(0)
-                    return True
-                except EOFError:
-                    return False
-            
-            return False
-        except Exception as e:
-            logger.warning(f"检测动图时出错: {e}")
-            return False
+        本地视频返回指向原文件的 VideoFile，由 ffmpeg 直接读取该路径。
+        """
+        size = os.path.getsize(local_path)
+        if size == 0:
+            logger.warning(f"本地图片为空文件: {local_path}")
+            return None
+        if size > self.max_download_bytes:
+            raise ImageRejected(f"文件大小 {size} 字节超过上限 {self.max_download_bytes} 字节")
 
-    def _get_frame_count(self, img: PILImage.Image) -> int:
-        """获取图片的帧数"""
-        try:
-            if hasattr(img, 'n_frames'):
-                return img.n_frames
-            
-            frame_count = 0
-            try:
-                while True:
-                    img.seek(frame_count)
-                    frame_count += 1
-            except EOFError:
-                pass
-            
-            img.seek(0)
-            return frame_count
-        except Exception as e:
-            logger.error(f"获取帧数时出错: {e}")
-            return 0
+        video = open_video_file(local_path)
+        if video is not None:
+            return video
 
-    async def _get_pic_text(self, img: PILImage.Image, new_w: int = 150, enforce_target_width: bool = False) -> str:
-        """将图片转换为字符文本"""
+        with open(local_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         try:
-            n = len(STR_MAP)
-            img = img.convert("L")
-            w, h = img.size
+            self._probe_image_header(data, complete=True)
+        except Exception:
+            data.close()
+            raise
+        return data
 
-            if w == 0 or h == 0:
-                logger.warning("输入图片尺寸非法，无法转换为字符文本")
-                return ""
+    async def _fetch_remote_image(self, image_url: str) -> Optional[SourceData]:
+        """下载网络图片，正文由 _read_image_body 流式读取并检查"""
+        return await self.fetcher.fetch(image_url, self._read_image_body)
 
-            target_w = w
-            if new_w:
-                if enforce_target_width or w > new_w:
-                    target_w = max(1, new_w)
+    async def _read_image_body(self, response: httpx.Response) -> Optional[SourceData]:
+        """流式读取图片正文
 
-            scale = target_w / w if w else 1
-            target_h = max(1, int(h * scale * FONT_ASPECT_RATIO))
+        下载过程中按字节上限截断，并在收到足够的文件头后提前检查尺寸/帧数，
+        超出限制的图片不会继续下载。文件头为视频容器时其余正文直接写入临时文件。
+        """
+        image_url = str(response.url)
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_download_bytes:
+            raise ImageRejected(f"文件大小 {content_length} 字节超过上限 {self.max_download_bytes} 字节")
 
-            if img.size != (target_w, target_h):
-                img = img.resize((target_w, target_h))
+        chunks: List[bytes] = []
+        received = 0
+        next_probe = PROBE_BYTES
+        probed = False
+        sniffed = False
+        body = response.aiter_bytes()
+        async for chunk in body:
+            chunks.append(chunk)
+            received += len(chunk)
+            if received > self.max_download_bytes:
+                raise ImageRejected(f"文件大小超过上限 {self.max_download_bytes} 字节")
+            if not sniffed and received >= VIDEO_HEADER_BYTES:
+                sniffed = True
+                video_ext = detect_video(b"".join(chunks))
+                if video_ext:
+                    return await self._save_video_body(body, chunks, video_ext)
+            if not probed and received >= next_probe:
+                # 文件头可能不在前 PROBE_BYTES 内（如带大段 EXIF 的 JPEG），解析失败时加倍后重试
+                probed = self._probe_image_header(b"".join(chunks), complete=False)
+                next_probe *= 2
 
-            s = ""
-            for x in range(img.height):
-                for y in range(img.width):
-                    gray_v = img.getpixel((y, x))
-                    s += STR_MAP[int(n * (gray_v / 256))]
-                s += "\n"
+        data = b"".join(chunks)
+        if not data:
+            logger.warning(f"图片 {image_url} 内容为空")
+            return None
+        # 完整检查读取 n_frames 时会遍历 GIF/WebP 的全部帧，与成本估算一样放到线程中执行
+        await asyncio.to_thread(self._probe_image_header, data, True)
+        return data
 
-            return s
-        except Exception as e:
-            logger.error(f"转换图片为字符文本时出错: {e}")
-            return ""
+    async def _save_video_body(self, body: AsyncIterator[bytes], head: List[bytes], video_ext: str) -> VideoFile:
+        """将视频正文（含已读取的开头部分）边下载边写入临时目录并计算内容哈希
 
-    async def _get_text_dimensions(self, font_path: str, font_size: int, text: str) -> tuple[ImageFont.FreeTypeFont, int, int]:
-        """获取文本的尺寸"""
+        内存中只保留当前数据块，占用与视频大小无关；下载失败或超出大小上限时删除已写入的文件。
+        """
+        f, path = self.scratch.create(video_ext)
+        digest = hashlib.sha256()
+        received = 0
         try:
-            font = ImageFont.truetype(font_path, font_size)
-            
-            # 创建一个临时图片用于计算文本尺寸
-            temp_img = PILImage.new("L", (1, 1))
-            draw = ImageDraw.Draw(temp_img)
-            
+            with f:
+                for chunk in head:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    received += len(chunk)
+                head.clear()
+                async for chunk in body:
+                    received += len(chunk)
+                    if received > self.max_download_bytes:
+                        raise ImageRejected(f"文件大小超过上限 {self.max_download_bytes} 字节")
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
             try:
-                # 旧版本PIL
-                w, h = draw.textsize(text, font=font)
-            except AttributeError:
-                # 新版本PIL (>=10.0)
-                bbox = draw.textbbox((0, 0), text, font=font)
-                w = bbox[2] - bbox[0]
-                h = bbox[3] - bbox[1]
-            
-            return font, w, h
-        except Exception as e:
-            logger.error(f"获取文本尺寸时出错: {e}")
-            # 使用默认字体
-            font = ImageFont.load_default()
-            # 简单估算尺寸
-            lines = text.split('\n')
-            max_width = max(len(line) for line in lines) * 8
-            height = len(lines) * 10
-            return font, max_width, height
-
-    async def _text_to_image(self, text: str) -> PILImage.Image:
-        """将文本转换为图片"""
-        try:
-            if not text:
-                return PILImage.new("L", (1, 1), "#FFFFFF")
-            
-            font_path = str(DEFAULT_FONT_PATH)
-            if not Path(font_path).exists():
-                logger.warning(f"字体文件不存在: {font_path}，使用默认字体")
-                font = ImageFont.load_default()
-                # 简单估算尺寸
-                lines = text.split('\n')
-                max_width = max(len(line) for line in lines) * 10
-                height = len(lines) * 12
-                img = PILImage.new("L", (max_width, height), "#FFFFFF")
-                draw = ImageDraw.Draw(img)
-                draw.text((0, 0), text, fill="#000000", font=font)
-                return img
-            
-            font, w, h = await self._get_text_dimensions(font_path, FONT_SIZE, text)
-            img = PILImage.new("L", (w, h), "#FFFFFF")
-            draw = ImageDraw.Draw(img)
-            draw.text((0, 0), text, fill="#000000", font=font)
-            return img
-        except Exception as e:
-            logger.error(f"将文本转换为图片时出错: {e}")
-            # 返回一个简单的错误图片
-            return PILImage.new("L", (100, 50), "#FFFFFF")
+                os.unlink(path)
+            except OSError:
+                pass
+            raise
+        logger.debug(f"视频已写入临时文件: {path}，{received} bytes")
+        return VideoFile(path, video_ext, received, digest.hexdigest(), temporary=True)
 
-    async def _process_static_image(self, img: PILImage.Image) -> Optional[bytes]:
-        """处理静态图片"""
+    def _probe_image_header(self, data: ImageData, complete: bool) -> bool:
+        """解析文件头并按策略检查尺寸和帧数
+
+        complete 为 False 时数据可能不完整，解析失败返回 False 以便稍后重试；
+        数据完整时还会检查各格式的总帧数。超出限制时抛出 ImageRejected。
+        """
+        if detect_video(data):
+            # 视频由 ffmpeg 按时长和帧数上限截断解码，这里只受下载大小限制
+            logger.debug("检测到视频文件头，跳过图片尺寸检查")
+            return True
+
+        magic_format = detect_format_from_bytes(bytes(data[:32]))
         try:
-            logger.info(f"开始处理静态图片，原始尺寸: {img.size}")
-            
-            text = await self._get_pic_text(img)
-            if not text:
-                logger.error("图片转换为字符文本失败")
-                return None
-            
-            logger.info(f"图片转换为字符文本成功，文本长度: {len(text)}")
-            
-            result_img = await self._text_to_image(text)
-            if not result_img:
-                logger.error("字符文本转换为图片失败")
-                return None
-            
-            logger.info(f"字符文本转换为图片成功，结果尺寸: {result_img.size}")
-            
-            output = io.BytesIO()
-            result_img.save(output, format="PNG")
-            result_bytes = output.getvalue()
-            
-            logger.info(f"静态图片字符画生成成功，大小: {len(result_bytes)} bytes")
-            return result_bytes
+            img = open_image(data)
+        except PILImage.DecompressionBombError as e:
+            raise ImageRejected(str(e))
         except Exception as e:
-            logger.error(f"处理静态图片时出错: {e}")
-            return None
+            if complete:
+                logger.warning(f"无法解析图片文件头: {e}")
+            return False
 
-    async def _process_animated_image(self, img: PILImage.Image) -> Optional[bytes]:
-        """处理动图（GIF/APNG/WebP/MNG）"""
-        try:
-            img_format = img.format or 'UNKNOWN'
-            logger.info(f"开始处理动图，格式: {img_format}")
-            
-            processed_frames: List[PILImage.Image] = []
-            frame_durations: List[float] = []
-            max_width = 0
-            max_height = 0
-            frame_index = 0
+        w, h = img.size
+        if w * h > self.max_image_pixels:
+            raise ImageRejected(f"图片尺寸 {w}x{h} 超过 {self.max_image_pixels} 像素上限")
 
+        # APNG 的帧数写在文件头 (acTL) 中，可在下载完成前检查；其他格式需完整数据
+        if complete or img.format == "PNG":
             try:
-                img.seek(0)
-            except EOFError:
-                logger.error(f"{img_format} 不包含有效帧")
-                return None
-
-            while True:
-                try:
-                    img.seek(frame_index)
-                except EOFError:
-                    break
-
-                raw_frame = img.copy()
-                frame_info = getattr(raw_frame, "info", {}) if hasattr(raw_frame, "info") else {}
-                frame = raw_frame.convert("RGBA")
-                original_size = frame.size
-
-                text = await self._get_pic_text(frame, new_w=80, enforce_target_width=True)
-                if not text:
-                    logger.warning(f"第 {frame_index} 帧字符画内容为空")
-
-                frame_img = await self._text_to_image(text)
-                if frame_img.mode != "L":
-                    frame_img = frame_img.convert("L")
-
-                processed_frames.append(frame_img)
-                max_width = max(max_width, frame_img.width)
-                max_height = max(max_height, frame_img.height)
-
-                duration_ms = frame_info.get("duration", img.info.get("duration", 80))
-                if not duration_ms or duration_ms <= 0:
-                    duration_ms = 80
-                frame_durations.append(duration_ms / 1000.0)
-
-                logger.info(
-                    f"第 {frame_index} 帧：原始尺寸 {original_size[0]}x{original_size[1]}，字符画尺寸 {frame_img.width}x{frame_img.height}，延迟 {duration_ms}ms"
-                )
-
-                frame_index += 1
-
-            frame_count = len(processed_frames)
-            logger.info(f"{img_format}处理完成，共处理 {frame_count} 帧")
-
-            if frame_count == 0:
-                logger.error(f"没有成功处理的{img_format}帧")
-                return None
-
-            target_size = (max_width, max_height)
-            if target_size[0] == 0 or target_size[1] == 0:
-                logger.error(f"字符画帧尺寸异常: {target_size}")
-                return None
-
-            uniform_frames: List[PILImage.Image] = []
+                frames = getattr(img, "n_frames", 1)
+            except Exception:
+                frames = 1
+            if frames > self.max_frames:
+                raise ImageRejected(f"动图帧数 {frames} 超过 {self.max_frames} 帧上限")
 
-            for idx, frame_img in enumerate(processed_frames):
-                if frame_img.size != target_size:
-                    padded_frame = PILImage.new("L", target_size, 255)
-                    padded_frame.paste(frame_img, (0, 0))
-                    uniform_frames.append(padded_frame)
-                    logger.debug(
-                        f"第 {idx} 帧已填充至统一尺寸 {target_size[0]}x{target_size[1]}"
-                    )
-                else:
-                    uniform_frames.append(frame_img)
-
-            unique_sizes = {frame.size for frame in uniform_frames}
-            if len(unique_sizes) != 1:
-                logger.error(f"字符画帧尺寸仍不一致: {unique_sizes}")
-                return None
-
-            uniform_frames = [frame if frame.mode == "L" else frame.convert("L") for frame in uniform_frames]
-
-            if not frame_durations:
-                duration_arg = 0.08
-            elif len(frame_durations) == 1:
-                duration_arg = frame_durations[0]
-            else:
-                duration_arg = frame_durations
-
-            output = io.BytesIO()
-            imageio.mimsave(output, uniform_frames, format="gif", duration=duration_arg)
-            result_bytes = output.getvalue()
-            logger.info(
-                f"{img_format}字符画生成成功，输出格式: GIF，大小: {len(result_bytes)} bytes，帧尺寸 {target_size[0]}x{target_size[1]}"
-            )
-            return result_bytes
-        except Exception as e:
-            logger.error(f"处理动图时出错: {e}")
-            return None
+        logger.debug(f"图片文件头检查通过：格式 {img.format or magic_format}，尺寸 {w}x{h}")
+        return True
 
     async def terminate(self):
         """插件销毁时的清理工作"""
-        await HTTP_CLIENT.aclose()
+        self.pool.shutdown()
+        self.engine.close()
+        await self.fetcher.aclose()
+        self.scratch.cleanup()
         logger.info("字符画插件已停止")
\ No newline at end of file